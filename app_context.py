@@ -0,0 +1,65 @@
+"""Application context holding the services shared across Iris.
+
+Services are built on first use rather than at import, so a command that
+only touches the filters or the store does not open the extraction cache,
+and importing a module does not read the travel data.
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from extraction_cache import ExtractionCache
+from travel_store import StorageBackend, create_store
+
+# Load environment variables
+load_dotenv()
+
+
+def create_extraction_cache() -> Optional[ExtractionCache]:
+    """Cache of email parser results, disabled by setting IRIS_EXTRACTION_CACHE to ''."""
+    path = os.getenv("IRIS_EXTRACTION_CACHE", "extraction_cache.db")
+    if not path:
+        return None
+    return ExtractionCache(path, max_entries=int(os.getenv("IRIS_EXTRACTION_CACHE_SIZE", "10000")))
+
+
+class AppContext:
+    """Shared services, each built on first attribute access.
+
+    Assigning an attribute replaces the service, for example to point the
+    assistant at a temporary store in a test or benchmark.
+    """
+
+    store: StorageBackend
+    extraction_cache: Optional[ExtractionCache]
+
+    _factories: Dict[str, Callable] = {
+        "store": create_store,
+        "extraction_cache": create_extraction_cache,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        # Only called for services that have not been built yet
+        factory = self._factories.get(name)
+        if factory is None:
+            raise AttributeError(name)
+        with self._lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = factory()
+        return self.__dict__[name]
+
+    def close(self):
+        """Close the services that were built, so the next access builds them again."""
+        with self._lock:
+            for name in self._factories:
+                service = self.__dict__.pop(name, None)
+                if service is not None:
+                    service.close()
+
+
+app = AppContext()
@@ -0,0 +1,114 @@
+"""Import-time benchmark for the Iris modules.
+
+Imports each module in a fresh interpreter under `python -X importtime`
+and reports the best of --repeat runs, along with the slowest imports it
+pulls in. Heavy dependencies (the agents SDK, the Google client stack)
+should only show up for the modules that need them. With --baseline, the
+results are compared to an earlier run saved with --output, and the
+benchmark fails if a module got slower by more than --tolerance.
+
+    python benchmarks/bench_import.py --output import_times.json
+    python benchmarks/bench_import.py --baseline import_times.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "email_filters",
+    "travel_store",
+    "app_context",
+    "travel_assistant",
+    "gmail_integration",
+    "mailbox_scheduler",
+    "travel_agents",
+]
+
+# Dependencies that are slow to import, reported when a module loads them
+HEAVY_MODULES = ["agents", "openai", "googleapiclient", "google_auth_oauthlib"]
+
+
+def import_times(module: str) -> Tuple[Dict[str, int], List[str]]:
+    """Import module in a new interpreter and return each import's cumulative microseconds, in import order.
+
+    Imports made by interpreter startup itself, such as site, are left out.
+    """
+    # Run outside the repo so nothing is created there, with no extraction cache
+    env = {**os.environ, "PYTHONPATH": ROOT, "IRIS_EXTRACTION_CACHE": ""}
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import sys; sys.stderr.write('START\\n'); import {module}"],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True
+        )
+    times = {}
+    order = []
+    stderr = result.stderr.split("START\n", 1)[1]
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        times[name] = int(cumulative)
+        order.append(name)
+    return times, order
+
+
+def measure(module: str, repeat: int, top: int) -> Dict:
+    best = None
+    for _ in range(repeat):
+        times, order = import_times(module)
+        if best is None or times[module] < best[0][module]:
+            best = (times, order)
+    times, order = best
+    # Only top-level packages, so a package and its submodules count once
+    packages = {}
+    for name in order:
+        root = name.split(".")[0]
+        if root != module and name == root:
+            packages[root] = times[name]
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {
+        "ms": round(times[module] / 1000, 1),
+        "heavy": [name for name in HEAVY_MODULES if name in times],
+        "slowest": {name: round(us / 1000, 1) for name, us in slowest}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module; the fastest is kept")
+    parser.add_argument("--top", type=int, default=5, help="slowest imported packages to list per module")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--baseline", help="results saved earlier with --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown over the baseline, as a fraction")
+    args = parser.parse_args()
+
+    results = {module: measure(module, args.repeat, args.top) for module in args.modules}
+
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for module, result in results.items():
+            before = baseline.get(module)
+            if before and result["ms"] > before["ms"] * (1 + args.tolerance):
+                regressions[module] = {"baseline_ms": before["ms"], "ms": result["ms"]}
+
+    print(json.dumps({"modules": results, "regressions": regressions}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
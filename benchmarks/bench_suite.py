@@ -0,0 +1,220 @@
+"""Offline benchmark suite for the email pipeline.
+
+Runs against a synthetic mailbox, with FakeRunner in place of the model
+and FakeGmailService in place of Gmail, so no network or API key is
+needed. Reports throughput and p50/p99 latency as JSON for:
+
+- is_travel_related and extract_dates, per email
+- add_travel_item and get_user_trips on the chosen store backend
+- process_gmail_emails end to end, with the latency of each
+  process_travel_email call and the number of model calls
+
+Travel emails go to the fake model by default, so --latency shapes the
+pipeline numbers. With --templates the template extractors handle the
+emails they recognise, and only the rest reach the model.
+
+With --baseline, throughput is compared to an earlier run saved with
+--output, and the suite fails if any benchmark got slower by more than
+--tolerance.
+
+    python benchmarks/bench_suite.py --size 1000 --latency 0.05 --output bench.json
+    python benchmarks/bench_suite.py --size 1000 --latency 0.05 --baseline bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gmail_integration
+import travel_assistant
+from app_context import app
+from email_filters import extract_dates, is_travel_related
+from fakes import FakeGmailService, FakeRunner
+from synthetic_mailbox import generate_mailbox
+from template_extractors import default_registry
+from travel_store import ShardedTravelStore, SQLiteTravelStore, TravelStore
+
+STORES = {
+    "json": lambda directory: TravelStore(os.path.join(directory, "travel_data.json")),
+    "journal": lambda directory: TravelStore(os.path.join(directory, "travel_data.json"), journal=True),
+    "sqlite": lambda directory: SQLiteTravelStore(os.path.join(directory, "travel_data.db")),
+    "sharded": lambda directory: ShardedTravelStore(os.path.join(directory, "travel_data")),
+}
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    # Nearest-rank percentile of sorted values
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(latencies: List[float], seconds: float) -> Dict:
+    """Throughput over the whole run and latency percentiles of single operations."""
+    ordered = sorted(latencies)
+    return {
+        "ops": len(latencies),
+        "seconds": round(seconds, 4),
+        "ops_per_sec": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(_percentile(ordered, 0.5) * 1000, 4) if ordered else None,
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 4) if ordered else None,
+    }
+
+
+def time_each(operation: Callable, inputs: List) -> Dict:
+    latencies = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for value in inputs:
+            op_started = time.perf_counter()
+            operation(value)
+            latencies.append(time.perf_counter() - op_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def bench_store(backend: str, emails: List[Dict], users: int, reads: int) -> Dict:
+    # Items come from the travel emails, spread round-robin over the users
+    registry = default_registry()
+    items = []
+    for email in emails:
+        match = registry.extract(email['body'])
+        if match is not None:
+            items.extend(match.items)
+    if not items:
+        return {}
+    writes = [(f"user{i % users}", item) for i, item in enumerate(items)]
+    user_ids = sorted({user_id for user_id, _ in writes})
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = STORES[backend](directory)
+        try:
+            results = {
+                "add_travel_item": time_each(lambda write: store.add_travel_item(*write), writes),
+                "get_user_trips": time_each(lambda user_id: store.get_user_trips(user_id), user_ids * reads),
+            }
+        finally:
+            store.close()
+    return results
+
+
+async def _run_pipeline(emails: List[Dict], state_file: str, mode: str) -> List[float]:
+    latencies = []
+    process_travel_email = gmail_integration.process_travel_email
+
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await process_travel_email(*args, mode=mode, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    gmail_integration.process_travel_email = timed
+    try:
+        await gmail_integration.process_gmail_emails(
+            "bench_user", service=FakeGmailService(emails), state_file=state_file, full_sync=True
+        )
+    finally:
+        gmail_integration.process_travel_email = process_travel_email
+    return latencies
+
+
+def bench_pipeline(backend: str, emails: List[Dict], runner: FakeRunner, mode: str, templates: bool) -> Dict:
+    """Sync the mailbox through process_gmail_emails into a fresh store."""
+    saved_registry = travel_assistant.template_registry
+    if not templates:
+        travel_assistant.template_registry = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        app.store = STORES[backend](directory)
+        app.extraction_cache = None  # Every run starts cold
+        try:
+            started = time.perf_counter()
+            with runner.installed(), contextlib.redirect_stdout(io.StringIO()):
+                latencies = asyncio.run(_run_pipeline(emails, os.path.join(directory, "sync.json"), mode))
+            seconds = time.perf_counter() - started
+            stored = len(app.store.get_user_trips("bench_user", include_past=True, include_cancelled=True))
+        finally:
+            app.close()
+            travel_assistant.template_registry = saved_registry
+
+    return {
+        "emails": len(emails),
+        "emails_per_sec": round(len(emails) / seconds, 1),
+        "model_calls": runner.calls,
+        "seconds": round(seconds, 4),
+        "items_stored": stored,
+        "process_travel_email": summarize(latencies, seconds),
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> Dict:
+    """Benchmarks whose throughput dropped by more than tolerance since the baseline."""
+    regressions = {}
+
+    def walk(current: Dict, before: Dict, path: str):
+        for key, value in current.items():
+            previous = before.get(key)
+            if isinstance(value, dict) and isinstance(previous, dict):
+                walk(value, previous, f"{path}{key}.")
+            elif key in ("ops_per_sec", "emails_per_sec") and value and previous:
+                if value < previous * (1 - tolerance):
+                    regressions[f"{path}{key}"] = {"baseline": previous, "current": value}
+
+    walk(results, baseline, "")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--travel-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--store", choices=sorted(STORES), default="json")
+    parser.add_argument("--users", type=int, default=20, help="users the store benchmark spreads items over")
+    parser.add_argument("--reads", type=int, default=10, help="get_user_trips calls per user")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake model call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random seconds per fake model call")
+    parser.add_argument("--mode", choices=travel_assistant.EXTRACTION_MODES, default="tools")
+    parser.add_argument("--templates", action="store_true",
+                        help="extract recognised emails with the template extractors instead of the fake model")
+    parser.add_argument("--skip-pipeline", action="store_true")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--baseline", help="results saved earlier with --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop, as a fraction")
+    args = parser.parse_args()
+
+    emails = generate_mailbox(args.size, args.travel_ratio, args.seed)
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "is_travel_related": time_each(is_travel_related, emails),
+        "extract_dates": time_each(lambda email: extract_dates(email['body']), emails),
+        "store": bench_store(args.store, emails, args.users, args.reads),
+    }
+    if not args.skip_pipeline:
+        runner = FakeRunner(args.latency, args.jitter, args.seed)
+        results["pipeline"] = bench_pipeline(args.store, emails, runner, args.mode, args.templates)
+        if not results["pipeline"]["model_calls"]:
+            print("Warning: the pipeline made no model calls, so --latency had no effect", file=sys.stderr)
+
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results["regressions"] = regressions
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
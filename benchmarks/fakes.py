@@ -0,0 +1,145 @@
+"""Offline stand-ins for the model runner and the Gmail API, for the benchmarks.
+
+FakeRunner replaces agents.Runner.run with a deterministic local
+extractor that waits a configurable latency per call, and
+FakeGmailService serves a synthetic mailbox through the parts of the
+Gmail API that gmail_integration uses.
+"""
+import asyncio
+import base64
+import json
+import random
+import re
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, List
+
+import agents
+from agents.tool_context import ToolContext
+
+import travel_agents
+from models import ExtractedItems, TravelItem
+from template_extractors import default_registry
+
+_USER_RE = re.compile(r'Process this email for user (.+?)\. Remember:')
+
+
+class FakeRunner:
+    """Deterministic replacement for Runner.run that needs no network.
+
+    Items are read from the email with the template extractors, standing
+    in for the model. email_extractor gets them back as ExtractedItems;
+    email_parser stores them through the store_travel_item tool, one call
+    per item, as the model would. Every call waits latency seconds plus up
+    to jitter seconds, drawn from a seeded generator.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._registry = default_registry(min_confidence=0.0)
+
+    def _extract(self, prompt: str) -> List[TravelItem]:
+        email_content = prompt.split("Email content:", 1)[-1]
+        match = self._registry.extract(email_content)
+        return match.items if match is not None else []
+
+    async def run(self, agent, prompt: str, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency + self._rng.uniform(0, self.jitter))
+        items = self._extract(prompt)
+
+        if getattr(agent, 'output_type', None) is ExtractedItems:
+            return SimpleNamespace(final_output=ExtractedItems(items=items))
+
+        user_id = _USER_RE.search(prompt).group(1)
+        for item in items:
+            arguments = json.dumps({
+                "user_id": user_id,
+                "item_type": item.type,
+                "description": item.description,
+                "start_time": item.start_time,
+                "end_time": item.end_time,
+                **item.details.model_dump(exclude_none=True)
+            })
+            context = ToolContext(context=None, tool_name="store_travel_item", tool_call_id=str(self.calls),
+                                  tool_arguments=arguments)
+            await travel_agents.store_travel_item.on_invoke_tool(context, arguments)
+        return SimpleNamespace(final_output=f"Stored {len(items)} travel items")
+
+    @contextmanager
+    def installed(self):
+        """Patch Runner.run with this fake for the duration of the block."""
+        original = agents.Runner.run
+        agents.Runner.run = self.run
+        try:
+            yield self
+        finally:
+            agents.Runner.run = original
+
+
+class _Request:
+    def __init__(self, execute):
+        self.execute = execute
+
+
+class _Batch:
+    def __init__(self, callback):
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, request_id):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self._requests:
+            self._callback(request_id, request.execute(), None)
+
+
+class FakeGmailService:
+    """Serves emails, dicts with a subject and a body, as a Gmail mailbox.
+
+    Supports message search with paging, full and metadata gets, batch
+    requests, the profile and an empty history.
+    """
+
+    def __init__(self, emails: List[Dict], history_id: str = '1000'):
+        self._messages = {f"m{i:06d}": email for i, email in enumerate(emails)}
+        self._history_id = history_id
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return SimpleNamespace(list=lambda **kwargs: _Request(lambda: {'historyId': self._history_id}))
+
+    def getProfile(self, userId):
+        return _Request(lambda: {'historyId': self._history_id})
+
+    def list(self, userId, q=None, maxResults=100, pageToken=None, **kwargs):
+        def execute():
+            ids = list(self._messages)
+            start = int(pageToken or 0)
+            page = {'messages': [{'id': message_id} for message_id in ids[start:start + maxResults]]}
+            if start + maxResults < len(ids):
+                page['nextPageToken'] = str(start + maxResults)
+            return page
+        return _Request(execute)
+
+    def get(self, userId, id, format='full', metadataHeaders=None):
+        def execute():
+            email = self._messages[id]
+            data = base64.urlsafe_b64encode(email['body'].encode('utf-8')).decode('ascii')
+            payload = {'headers': [{'name': 'Subject', 'value': email['subject']}]}
+            if format == 'full':
+                payload.update(mimeType='text/plain', body={'data': data})
+            return {'id': id, 'payload': payload, 'sizeEstimate': 200 + len(data)}
+        return _Request(execute)
+
+    def new_batch_http_request(self, callback):
+        return _Batch(callback)
@@ -0,0 +1,155 @@
+"""Synthetic mailbox generator for the benchmarks.
+
+Emails are built from templates modelled on the samples in test_emails.py,
+mixed with promotional and unrelated mail, and are reproducible for a seed.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+CITIES = [
+    ('New York', 'JFK'), ('San Francisco', 'SFO'), ('Los Angeles', 'LAX'),
+    ('Chicago', 'ORD'), ('Seattle', 'SEA'), ('Boston', 'BOS'), ('Miami', 'MIA')
+]
+AIRLINES = [('American Airlines', 'AA'), ('United Airlines', 'UA'), ('Delta Air Lines', 'DL')]
+HOTELS = ['The Grand Hotel Chicago', 'Harbor View Inn', 'Downtown Suites', 'Parkside Lodge']
+TOURS = ['Chicago Architecture River Cruise', 'Golden Gate Bike Tour', 'Museum of Modern Art Entry']
+
+
+# Legal and marketing boilerplate appended to most real emails
+FOOTER = """
+    ----------------------------------------------------------------
+    You are receiving this email because you have an account with us.
+    This message was sent from an unmonitored address; please do not reply.
+    Terms and conditions apply. Fares, rates and availability are subject to
+    change without notice. Baggage fees may apply. See our privacy policy for
+    details about how we collect, use and share your personal information.
+    To update your communication preferences or unsubscribe, visit your
+    account settings. Copyright (c) All rights reserved.
+    Download our app | Follow us | Help center | Contact us
+"""
+
+
+def _footer(rng: random.Random) -> str:
+    return FOOTER * rng.randint(2, 8)
+
+
+def _code(rng: random.Random, length: int = 6) -> str:
+    return ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(length))
+
+
+def _date(rng: random.Random) -> datetime:
+    # Mostly upcoming travel, with some past trips
+    return datetime.now() + timedelta(days=rng.randint(-60, 240), hours=rng.randint(6, 20))
+
+
+def flight_email(rng: random.Random) -> Dict:
+    (origin, origin_code), (dest, dest_code) = rng.sample(CITIES, 2)
+    airline, prefix = rng.choice(AIRLINES)
+    departure = _date(rng)
+    arrival = departure + timedelta(hours=rng.randint(1, 6), minutes=rng.choice([0, 15, 30, 45]))
+    return {
+        'subject': f'Flight Confirmation - {airline}',
+        'body': f"""
+    Dear Traveler,
+
+    Your flight has been confirmed:
+    Flight: {prefix}{rng.randint(100, 9999)}
+    From: {origin} ({origin_code})
+    To: {dest} ({dest_code})
+    Date: {departure.strftime('%B %d, %Y')}
+    Departure: {departure.strftime('%I:%M %p')}
+    Arrival: {arrival.strftime('%I:%M %p')}
+
+    Confirmation number: {_code(rng)}
+    Seat: {rng.randint(1, 40)}{rng.choice('ABCDEF')}
+    """ + _footer(rng)
+    }
+
+
+def hotel_email(rng: random.Random) -> Dict:
+    hotel = rng.choice(HOTELS)
+    check_in = _date(rng).replace(hour=15, minute=0)
+    check_out = check_in + timedelta(days=rng.randint(1, 7), hours=-4)
+    return {
+        'subject': 'Hotel Booking Confirmation',
+        'body': f"""
+    Dear Guest,
+
+    Thank you for choosing {hotel}!
+
+    Booking Details:
+    - Hotel: {hotel}
+    - Check-in: {check_in.strftime('%B %d, %Y, %I:%M %p')}
+    - Check-out: {check_out.strftime('%B %d, %Y, %I:%M %p')}
+    - Room Type: {rng.choice(['Deluxe King', 'Standard Queen', 'Suite'])}
+    - Confirmation #: HOTEL{rng.randint(100, 99999)}
+
+    We look forward to your stay!
+    """ + _footer(rng)
+    }
+
+
+def activity_email(rng: random.Random) -> Dict:
+    tour = rng.choice(TOURS)
+    start = _date(rng)
+    return {
+        'subject': f'Activity Confirmation - {tour}',
+        'body': f"""
+    Hello!
+
+    Your booking for the {tour} has been confirmed.
+
+    Details:
+    - Tour: {tour}
+    - Date: {start.strftime('%m/%d/%Y')} at {start.strftime('%I:%M %p')}
+    - Duration: 1.5 hours
+    - Booking Reference: TOUR{rng.randint(100000, 999999)}
+
+    Please arrive 15 minutes before departure.
+    """ + _footer(rng)
+    }
+
+
+def promotional_email(rng: random.Random) -> Dict:
+    (_, origin), (_, dest) = rng.sample(CITIES, 2)
+    return {
+        'subject': rng.choice([
+            f'Flight deals from {origin} to {dest}',
+            'Price alert: fares are dropping',
+            'Your weekly travel newsletter',
+            'Hotel sale - up to 40% off'
+        ]),
+        'body': f"""
+    Don't miss out! Fares from {origin} to {dest} start at ${rng.randint(49, 399)}.99.
+    Book by {_date(rng).strftime('%B %d, %Y')} to lock in this offer.
+    Unsubscribe from marketing emails at any time.
+    """ * rng.randint(1, 4) + _footer(rng)
+    }
+
+
+def other_email(rng: random.Random) -> Dict:
+    return {
+        'subject': rng.choice(['Your order has shipped', 'Meeting notes', 'Re: dinner on friday']),
+        'body': f"""
+    Hi there,
+
+    Following up on our conversation from {_date(rng).strftime('%m/%d/%Y')}.
+    Your order number is {rng.randint(10000000, 99999999)} and the total was ${rng.randint(5, 500)}.00.
+    Let me know if you have any questions.
+    """ * rng.randint(1, 3) + _footer(rng)
+    }
+
+
+TRAVEL_TEMPLATES = [flight_email, hotel_email, activity_email]
+OTHER_TEMPLATES = [promotional_email, other_email]
+
+
+def generate_mailbox(size: int, travel_ratio: float = 0.3, seed: int = 0) -> List[Dict]:
+    """Generate size emails, of which about travel_ratio are booking confirmations."""
+    rng = random.Random(seed)
+    emails = []
+    for _ in range(size):
+        templates = TRAVEL_TEMPLATES if rng.random() < travel_ratio else OTHER_TEMPLATES
+        emails.append(rng.choice(templates)(rng))
+    return emails
@@ -0,0 +1,219 @@
+"""Local scorer that gates email parser runs.
+
+A logistic regression over hashed word and bigram features, trained on
+emails labeled with the email parser's own decisions: whether it stored
+any travel items. Emails that pass the keyword pre-filter but score below
+the threshold are skipped without a model call.
+
+Training data is JSON lines with subject, body and label. Gmail sync
+writes it to IRIS_CLASSIFIER_LOG as the parser runs.
+
+    python email_classifier.py train decisions.jsonl --model email_classifier.json
+    python email_classifier.py evaluate decisions.jsonl --model email_classifier.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from email_filters import match_keywords
+
+DEFAULT_N_FEATURES = 2 ** 18
+DEFAULT_THRESHOLD = 0.2  # Low, since a wrongly skipped booking costs more than an extra model call
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_DIGIT_RE = re.compile(r'\d')
+
+
+def _tokens(text: str) -> List[str]:
+    # Digits are replaced so flight numbers, codes and dates share features
+    return [_DIGIT_RE.sub('9', token) for token in _TOKEN_RE.findall(text.lower())]
+
+
+def _feature_names(email_content: Dict) -> Iterable[str]:
+    for prefix, field in (('s', 'subject'), ('b', 'body')):
+        tokens = _tokens(email_content.get(field) or '')
+        for i, token in enumerate(tokens):
+            yield f"{prefix}:{token}"
+            if i:
+                yield f"{prefix}:{tokens[i - 1]} {token}"
+    # The pre-filter's own signals
+    matches = match_keywords(email_content)
+    for indicator in matches.indicators:
+        yield f"indicator:{indicator}"
+    for category in matches.categories:
+        yield f"category:{category}"
+    if matches.booking_pattern:
+        yield "booking_pattern"
+
+
+class EmailClassifier:
+    """Hashed-feature logistic regression scoring how likely an email is a booking."""
+
+    def __init__(self, n_features: int = DEFAULT_N_FEATURES, weights: Optional[Dict[int, float]] = None,
+                 bias: float = 0.0, threshold: float = DEFAULT_THRESHOLD):
+        self.n_features = n_features
+        self.weights = weights or {}
+        self.bias = bias
+        self.threshold = threshold
+
+    def features(self, email_content: Dict) -> Dict[int, float]:
+        """Hashed feature vector, binary and scaled to unit length."""
+        indexes = {zlib.crc32(name.encode('utf-8')) % self.n_features for name in _feature_names(email_content)}
+        if not indexes:
+            return {}
+        value = 1.0 / math.sqrt(len(indexes))
+        return dict.fromkeys(indexes, value)
+
+    def _score_features(self, features: Dict[int, float]) -> float:
+        margin = self.bias + sum(self.weights.get(index, 0.0) * value for index, value in features.items())
+        # Clamped so exp cannot overflow
+        return 1.0 / (1.0 + math.exp(-max(min(margin, 30.0), -30.0)))
+
+    def score(self, email_content: Dict) -> float:
+        """Probability that the email parser would store items for this email."""
+        return self._score_features(self.features(email_content))
+
+    def should_extract(self, email_content: Dict) -> bool:
+        """Check if the email scores at or above the threshold."""
+        return self.score(email_content) >= self.threshold
+
+    def train(self, examples: List[Tuple[Dict, bool]], epochs: int = 10, learning_rate: float = 0.5,
+              l2: float = 1e-6, seed: int = 0):
+        """Fit the weights with stochastic gradient descent on (email, label) pairs."""
+        vectors = [(self.features(email_content), 1.0 if label else 0.0) for email_content, label in examples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(vectors)
+            rate = learning_rate / (1 + epoch)
+            for features, label in vectors:
+                gradient = self._score_features(features) - label
+                self.bias -= rate * gradient
+                for index, value in features.items():
+                    weight = self.weights.get(index, 0.0)
+                    self.weights[index] = weight - rate * (gradient * value + l2 * weight)
+
+    def save(self, file_path: str):
+        with open(file_path, 'w') as f:
+            json.dump({
+                'n_features': self.n_features,
+                'bias': self.bias,
+                'threshold': self.threshold,
+                'weights': {str(index): weight for index, weight in self.weights.items() if weight}
+            }, f)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'EmailClassifier':
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        return cls(
+            n_features=data['n_features'],
+            weights={int(index): weight for index, weight in data['weights'].items()},
+            bias=data['bias'],
+            threshold=data.get('threshold', DEFAULT_THRESHOLD)
+        )
+
+
+def load_classifier() -> Optional[EmailClassifier]:
+    """Load the model named by IRIS_CLASSIFIER_MODEL, or None if it is not set or missing.
+
+    IRIS_CLASSIFIER_THRESHOLD overrides the threshold saved with the model.
+    """
+    model_path = os.getenv('IRIS_CLASSIFIER_MODEL')
+    if not model_path:
+        return None
+    if not os.path.exists(model_path):
+        print(f"Classifier model {model_path} not found, sending every candidate to the email parser")
+        return None
+    classifier = EmailClassifier.load(model_path)
+    if os.getenv('IRIS_CLASSIFIER_THRESHOLD'):
+        classifier.threshold = float(os.getenv('IRIS_CLASSIFIER_THRESHOLD'))
+    return classifier
+
+
+def log_decision(log_path: str, email_content: Dict, label: bool):
+    """Append an email and the email parser's decision to a training data file."""
+    with open(log_path, 'a') as f:
+        f.write(json.dumps({
+            'subject': email_content['subject'],
+            'body': email_content['body'],
+            'label': label
+        }) + '\n')
+
+
+def load_examples(file_path: str) -> List[Tuple[Dict, bool]]:
+    """Read (email, label) pairs from a JSON lines file."""
+    examples = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append(({'subject': record['subject'], 'body': record['body']}, bool(record['label'])))
+    return examples
+
+
+def evaluate(classifier: EmailClassifier, examples: List[Tuple[Dict, bool]],
+             threshold: Optional[float] = None) -> Dict:
+    """Precision and recall of the classifier against the email parser's decisions."""
+    threshold = classifier.threshold if threshold is None else threshold
+    true_positives = false_positives = false_negatives = 0
+    for email_content, label in examples:
+        predicted = classifier.score(email_content) >= threshold
+        if predicted and label:
+            true_positives += 1
+        elif predicted:
+            false_positives += 1
+        elif label:
+            false_negatives += 1
+    skipped = len(examples) - true_positives - false_positives
+    return {
+        'threshold': threshold,
+        'examples': len(examples),
+        'precision': true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0,
+        'recall': true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0,
+        'parser_calls_skipped': skipped,
+        'bookings_missed': false_negatives
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and evaluate the email parser gate")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="train a model on labeled emails")
+    train_parser.add_argument('data', help="JSON lines file of labeled emails")
+    train_parser.add_argument('--model', default='email_classifier.json')
+    train_parser.add_argument('--epochs', type=int, default=10)
+    train_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    train_parser.add_argument('--holdout', type=float, default=0.2, help="fraction of emails kept back for evaluation")
+
+    evaluate_parser = subparsers.add_parser('evaluate', help="report precision and recall against labeled emails")
+    evaluate_parser.add_argument('data', help="JSON lines file of labeled emails")
+    evaluate_parser.add_argument('--model', default='email_classifier.json')
+    evaluate_parser.add_argument('--threshold', type=float, action='append',
+                                 help="threshold to report, may be repeated (default: the model's)")
+
+    args = parser.parse_args()
+    examples = load_examples(args.data)
+
+    if args.command == 'train':
+        random.Random(0).shuffle(examples)
+        held_out = int(len(examples) * args.holdout)
+        classifier = EmailClassifier(threshold=args.threshold)
+        classifier.train(examples[held_out:], epochs=args.epochs)
+        classifier.save(args.model)
+        print(f"Trained on {len(examples) - held_out} emails, saved to {args.model}")
+        if held_out:
+            print(json.dumps(evaluate(classifier, examples[:held_out]), indent=2))
+    else:
+        classifier = EmailClassifier.load(args.model)
+        for threshold in args.threshold or [None]:
+            print(json.dumps(evaluate(classifier, examples, threshold), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Trim email bodies before they go into the email parser prompt.
+
+HTML remnants are always removed and whitespace collapsed. Only if the
+text is over the token budget is quoted reply history dropped, when the
+reply itself has a booking reference, and so are footers and marketing
+boilerplate. If it is still over the budget, only the lines around booking
+signals (the booking indicators, dates and booking patterns the pre-filter
+looks for) are kept.
+"""
+import html
+import re
+import threading
+from typing import Dict, List, NamedTuple
+
+from email_filters import BOOKING_PATTERNS, has_booking_signal
+
+TRIMMER_VERSION = 2  # Bump when trimming changes what the parser sees
+
+_BLOCK_TAG_RE = re.compile(r'<(?:br|/?(?:p|div|tr|li|table|h[1-6]))\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<(?:style|script)\b.*?</(?:style|script)>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_QUOTE_RE = re.compile(r'^[ \t]*>')
+_REPLY_HEADER_RE = re.compile(r'^\s*(?:-{2,}\s*Original Message\s*-{2,}|On .+ wrote:)\s*$', re.IGNORECASE)
+_SEPARATOR_RE = re.compile(r'^[\s\-=_*~#|]*$')
+_BOILERPLATE_RE = re.compile(
+    r'unsubscribe|privacy policy|all rights reserved|copyright|terms (?:and|&) conditions|'
+    r'do not reply|unmonitored|you are receiving this|communication preferences|'
+    r'download our app|follow us|help center|view (?:this email )?in (?:your|a) browser',
+    re.IGNORECASE
+)
+_AIRPORT_RE = re.compile(r'\([A-Z]{3}\)')
+# The booking, confirmation, reservation and itinerary number patterns
+_REFERENCE_RES = tuple(re.compile(pattern, re.IGNORECASE) for pattern in BOOKING_PATTERNS[:4])
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for rate limiting, at about four characters per token."""
+    return len(text) // 4 + 1
+
+
+def _has_reference(line: str) -> bool:
+    # The patterns ignore case, so also require a digit, as in XYZ789,
+    # to tell a reference from a word like "confirmation details"
+    return any(re.search(r'\d', match.group(0))
+               for pattern in _REFERENCE_RES for match in pattern.finditer(line))
+
+
+def _collapse(lines: List[str]) -> str:
+    return '\n'.join(collapsed for collapsed in (' '.join(line.split()) for line in lines) if collapsed)
+
+
+class TrimResult(NamedTuple):
+    text: str
+    original_tokens: int
+    tokens: int
+
+
+class EmailTrimmer:
+    """Shrinks email bodies to a token budget, counting the tokens saved."""
+
+    def __init__(self, max_tokens: int = 1000, context_lines: int = 2):
+        self.max_tokens = max_tokens
+        self.context_lines = context_lines
+        self.emails = 0
+        self.original_tokens = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> str:
+        """Settings that change the trimmed text, for cache keys."""
+        return f"trim-v{TRIMMER_VERSION}:{self.max_tokens}:{self.context_lines}"
+
+    def _strip_quotes(self, lines: List[str]) -> List[str]:
+        for i, line in enumerate(lines):
+            if _REPLY_HEADER_RE.match(line):
+                kept = lines[:i]
+                break
+        else:
+            kept = lines
+        kept = [line for line in kept if not _QUOTE_RE.match(line)]
+        # A reply or forward may quote the booking itself, so only drop the
+        # quoted text if the reply has a booking reference of its own
+        if any(_has_reference(line) for line in kept):
+            return kept
+        return [line.lstrip(' \t>') for line in lines]
+
+    def _is_boilerplate(self, line: str) -> bool:
+        return bool(_SEPARATOR_RE.match(line) or _BOILERPLATE_RE.search(line)) and not has_booking_signal(line)
+
+    def _signal_windows(self, lines: List[str]) -> List[str]:
+        keep = [False] * len(lines)
+        for i, line in enumerate(lines):
+            if has_booking_signal(line) or _AIRPORT_RE.search(line):
+                for j in range(max(0, i - self.context_lines), min(len(lines), i + self.context_lines + 1)):
+                    keep[j] = True
+        windows = []
+        for i, line in enumerate(lines):
+            if keep[i]:
+                windows.append(line)
+            elif windows and windows[-1] != '...':
+                windows.append('...')
+        return windows
+
+    def trim(self, body: str) -> TrimResult:
+        """Trim an email body and record the tokens saved."""
+        text = html.unescape(_TAG_RE.sub(' ', _BLOCK_TAG_RE.sub('\n', body)))
+        lines = text.splitlines()
+        trimmed = _collapse(lines)
+        if estimate_tokens(trimmed) > self.max_tokens:
+            lines = [' '.join(line.split()) for line in self._strip_quotes(lines)]
+            lines = [line for line in lines if line and not self._is_boilerplate(line)]
+            trimmed = '\n'.join(lines)
+        if estimate_tokens(trimmed) > self.max_tokens:
+            trimmed = '\n'.join(self._signal_windows(lines))
+            # Keep the start of the email if the windows are still too long
+            trimmed = trimmed[:self.max_tokens * 4]
+
+        result = TrimResult(trimmed, estimate_tokens(body), estimate_tokens(trimmed))
+        with self._lock:
+            self.emails += 1
+            self.original_tokens += result.original_tokens
+            self.tokens += result.tokens
+        return result
+
+    def stats(self) -> Dict:
+        """Emails trimmed and tokens saved since the trimmer was created."""
+        return {
+            "emails": self.emails,
+            "original_tokens": self.original_tokens,
+            "tokens": self.tokens,
+            "tokens_saved": self.original_tokens - self.tokens
+        }
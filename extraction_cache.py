@@ -0,0 +1,92 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class ExtractionCache:
+    """Disk-backed LRU cache of email parser results.
+
+    Entries are keyed by a hash of the normalized email body and the parser
+    version, and hold the travel items the parser stored for that email
+    (possibly none) plus its final output. A hit can be replayed into the
+    store without calling the model. Once the cache holds more than
+    max_entries, the least recently used entries are evicted.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used);
+    """
+
+    def __init__(self, file_path="extraction_cache.db", max_entries: int = 10000):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(file_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self._size = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def normalize(body: str) -> str:
+        """Normalize an email body so resends and forwards of the same email match."""
+        # Drop reply/forward quote markers, then collapse all whitespace
+        body = re.sub(r'^[ \t]*(?:>[ \t]?)+', '', body, flags=re.MULTILINE)
+        return ' '.join(body.split())
+
+    def key(self, body: str, version: str) -> str:
+        """Content address of an email body for a given parser version."""
+        normalized = self.normalize(body)
+        return hashlib.sha256(f"{version}\0{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for key, or None on a miss."""
+        with self._lock:
+            row = self.conn.execute("SELECT result FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+
+    def put(self, key: str, result: Dict):
+        """Store a result, evicting least recently used entries beyond max_entries."""
+        with self._lock, self.conn:
+            exists = self.conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, result, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(result, default=str), time.time())
+            )
+            if not exists:
+                self._size += 1
+            if self._size > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                    (self._size - self.max_entries,)
+                )
+                self._size = self.max_entries
+
+    def stats(self) -> Dict:
+        """Hit and miss counters since the cache was opened."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size
+        }
+
+    def close(self):
+        self.conn.close()
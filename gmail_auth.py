@@ -0,0 +1,134 @@
+"""Gmail credentials and service objects.
+
+Tokens are stored as JSON (readable only by the owner) rather than
+pickled, and a token.pickle left by earlier versions is converted on
+first use. Services are built from the discovery document bundled with
+google-api-python-client, so building one needs no network, and are
+cached per token file for the life of the process. Tokens are refreshed
+shortly before they expire, and the refreshed token is saved.
+"""
+import os
+import pickle
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+# The Google client libraries take a while to import, so they are only
+# loaded once credentials are actually needed
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+# If modifying these scopes, delete the stored token files.
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+TOKEN_FILE = 'token.json'
+CLIENT_SECRETS_FILE = 'gmail-oauth.json'
+
+# Tokens are refreshed when they have less than this left, so a sync never
+# starts with a token that expires part way through
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def load_credentials(token_file: str = TOKEN_FILE) -> Optional['Credentials']:
+    """Load stored credentials, converting a legacy pickle next to token_file to JSON."""
+    from google.oauth2.credentials import Credentials
+    if os.path.exists(token_file):
+        return Credentials.from_authorized_user_file(token_file, SCOPES)
+
+    legacy_file = os.path.splitext(token_file)[0] + '.pickle'
+    if not os.path.exists(legacy_file):
+        return None
+    with open(legacy_file, 'rb') as token:
+        creds = pickle.load(token)
+    save_credentials(creds, token_file)
+    os.remove(legacy_file)
+    print(f"Moved credentials from {legacy_file} to {token_file}")
+    return creds
+
+
+def save_credentials(creds: 'Credentials', token_file: str = TOKEN_FILE):
+    """Atomically write credentials as JSON, readable only by the owner."""
+    tmp_file = f"{token_file}.tmp"
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(creds.to_json())
+    os.chmod(tmp_file, 0o600)  # In case the file already existed with wider permissions
+    os.replace(tmp_file, token_file)
+
+
+def needs_refresh(creds: 'Credentials', margin: timedelta = TOKEN_REFRESH_MARGIN) -> bool:
+    """True if the token is missing, expired or expires within margin."""
+    if not creds.token or not creds.expiry:
+        return not creds.valid
+    # Credentials keep expiry as naive UTC
+    return creds.expiry - datetime.utcnow() < margin
+
+
+def authorize(token_file: str = TOKEN_FILE) -> 'Credentials':
+    """Run the browser OAuth flow and store the resulting credentials."""
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    if not os.path.exists(CLIENT_SECRETS_FILE):
+        print(f"Error: {CLIENT_SECRETS_FILE} file not found!")
+        print("Please download your OAuth 2.0 credentials from Google Cloud Console")
+        print(f"and save them as '{CLIENT_SECRETS_FILE}' in this directory.")
+        exit(1)
+
+    flow = InstalledAppFlow.from_client_secrets_file(
+        CLIENT_SECRETS_FILE,
+        SCOPES,
+        redirect_uri='http://localhost:8080'
+    )
+    creds = flow.run_local_server(
+        port=8080,
+        success_message='Authentication successful! You can close this window.',
+        authorization_prompt_message='Please visit this URL to authorize this application: '
+    )
+    save_credentials(creds, token_file)
+    return creds
+
+
+class GmailServiceFactory:
+    """Builds Gmail services once per token file and keeps their tokens fresh.
+
+    get() returns the cached service for a token file, refreshing its
+    credentials in place first if they are about to expire. The service
+    holds the same credentials object, so it never needs rebuilding.
+    """
+
+    def __init__(self, refresh_margin: timedelta = TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._services: Dict[str, Tuple['Credentials', object]] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.refreshes = 0
+
+    def get(self, token_file: str = TOKEN_FILE):
+        """Return a Gmail service for the credentials stored in token_file."""
+        from google.auth.transport.requests import Request
+        from googleapiclient.discovery import build
+        with self._lock:
+            cached = self._services.get(token_file)
+            creds = cached[0] if cached else load_credentials(token_file)
+
+            if creds and creds.refresh_token and needs_refresh(creds, self.refresh_margin):
+                creds.refresh(Request())
+                save_credentials(creds, token_file)
+                self.refreshes += 1
+            elif not creds or not creds.valid:
+                creds = authorize(token_file)
+                cached = None
+
+            if cached is None:
+                service = build('gmail', 'v1', credentials=creds, static_discovery=True, cache_discovery=False)
+                self._services[token_file] = (creds, service)
+                self.builds += 1
+            return self._services[token_file][1]
+
+    def invalidate(self, token_file: str = TOKEN_FILE):
+        """Forget the cached service, so the next get() reloads credentials and rebuilds it."""
+        with self._lock:
+            self._services.pop(token_file, None)
+
+
+# Shared by every sync in the process
+gmail_services = GmailServiceFactory()
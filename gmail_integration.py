@@ -1,240 +1,536 @@
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import os.path
-import pickle
+import json
 import base64
-from email.mime.text import MIMEText
 import re
-from typing import List, Dict, Optional, Tuple
-from travel_assistant import process_travel_email, get_travel_summary
+from html.parser import HTMLParser
+from email.mime.text import MIMEText
+from typing import AsyncIterator, List, Dict, NamedTuple, Optional, Tuple
+from app_context import app
+from gmail_auth import SCOPES, TOKEN_FILE, gmail_services
+from travel_assistant import process_travel_email, format_itinerary, template_registry, email_trimmer
+from email_classifier import EmailClassifier, load_classifier, log_decision
+from email_filters import (TRAVEL_KEYWORDS, DATE_PATTERNS, extract_dates, has_future_dates, is_travel_related,
+                           is_excluded_subject, FilterPipeline, stage_order_from_env)
 import asyncio
+import contextlib
+import random
+import threading
+import time
+import weakref
 from datetime import datetime, timedelta
-import dateutil.parser
-from dateutil.tz import tzlocal
-import pytz
-
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-
-# Travel-related keywords and patterns
-TRAVEL_KEYWORDS = {
-    'booking_indicators': [
-        'confirmation', 'confirmed', 'e-ticket', 'electronic ticket',
-        'booking reference', 'reservation number', 'itinerary', 'check-in',
-        'boarding pass', 'travel document'
-    ],
-    'exclusion_words': [
-        'deal', 'deals', 'offer', 'offers', 'sale', 'track', 'tracking',
-        'price alert', 'price drop', 'newsletter', 'subscription',
-        'marketing', 'promotional', 'promo', 'discount', 'past'
-    ],
-    'transportation': [
-        'flight', 'airline', 'boarding pass',
-        'train', 'rail', 'bus', 'cruise', 'ferry',
-        'car rental', 'rental car', 'shuttle'
-    ],
-    'accommodation': [
-        'hotel', 'reservation', 'check-in',
-        'checkout', 'room', 'suite', 'hostel', 'bnb'
-    ],
-    'activities': [
-        'tour', 'activity', 'excursion', 'attraction',
-        'museum', 'park', 'show', 'event', 'ticket'
-    ]
-}
-
-# Date patterns to look for in emails
-DATE_PATTERNS = [
-    # Common date formats
-    r'(?:departure|arrival|check-?in|check-?out|date):\s*(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-    r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\s*(?:at|@)?\s*(\d{1,2}:\d{2}(?:\s*[AaPp][Mm])?)',
-    r'(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?|Sep(?:tember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\s+\d{1,2},?\s+\d{4}',
-    # ISO format
-    r'\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}:\d{2})?',
-    # Natural language
-    r'(?:tomorrow|next (?:week|month|monday|tuesday|wednesday|thursday|friday|saturday|sunday))',
-]
-
-def extract_dates(text: str) -> List[datetime]:
-    """Extract all dates from text and return them as datetime objects."""
-    dates = []
-    now = datetime.now(tzlocal())
-    
-    for pattern in DATE_PATTERNS:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            try:
-                # Try to parse the date string
-                date_str = match.group(0)
-                
-                # Handle natural language dates
-                if 'tomorrow' in date_str.lower():
-                    dates.append(now + timedelta(days=1))
-                    continue
-                elif 'next' in date_str.lower():
-                    if 'week' in date_str.lower():
-                        dates.append(now + timedelta(days=7))
-                    elif 'month' in date_str.lower():
-                        dates.append(now + timedelta(days=30))
-                    else:  # next day of week
-                        day = date_str.lower().split()[-1]
-                        days_ahead = {'monday': 0, 'tuesday': 1, 'wednesday': 2,
-                                    'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6}
-                        today = now.weekday()
-                        days_until = days_ahead[day] - today
-                        if days_until <= 0:
-                            days_until += 7
-                        dates.append(now + timedelta(days=days_until))
-                    continue
-                
-                # Try parsing with dateutil
-                parsed_date = dateutil.parser.parse(date_str, fuzzy=True)
-                
-                # If year is not specified, assume it's this year or next year
-                if parsed_date.year < 100:
-                    parsed_date = parsed_date.replace(year=2000 + parsed_date.year)
-                
-                # Add timezone if not present
-                if parsed_date.tzinfo is None:
-                    parsed_date = parsed_date.replace(tzinfo=tzlocal())
-                
-                dates.append(parsed_date)
-            except (ValueError, TypeError):
-                continue
-    
-    return dates
 
-def has_future_dates(email_content: Dict) -> Tuple[bool, Optional[datetime]]:
-    """Check if the email contains any future dates."""
-    now = datetime.now(tzlocal())
-    text = f"{email_content['subject']} {email_content['body']}"
-    
-    dates = extract_dates(text)
-    future_dates = [d for d in dates if d > now]
-    
-    if future_dates:
-        return True, min(future_dates)  # Return the earliest future date
-    return False, None
-
-def get_gmail_service():
-    """Gets valid user credentials from storage."""
-    creds = None
-    token_file = 'token.pickle'
-    
-    if os.path.exists(token_file):
-        with open(token_file, 'rb') as token:
-            creds = pickle.load(token)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if not os.path.exists('gmail-oauth.json'):
-                print("Error: gmail-oauth.json file not found!")
-                print("Please download your OAuth 2.0 credentials from Google Cloud Console")
-                print("and save them as 'gmail-oauth.json' in this directory.")
-                exit(1)
-                
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'gmail-oauth.json', 
-                SCOPES,
-                redirect_uri='http://localhost:8080'
-            )
-            creds = flow.run_local_server(
-                port=8080,
-                success_message='Authentication successful! You can close this window.',
-                authorization_prompt_message='Please visit this URL to authorize this application: '
-            )
-        
-        # Save the credentials for the next run
-        with open(token_file, 'wb') as token:
-            pickle.dump(creds, token)
+# Message fetch settings. Gmail accepts up to 100 calls per batch request,
+# but larger batches are more likely to be rate limited.
+FETCH_BATCH_SIZE = int(os.getenv('GMAIL_FETCH_BATCH_SIZE', '50'))
+FETCH_MAX_RETRIES = 5
+FETCH_INITIAL_BACKOFF = 1.0  # Seconds, doubled after each retry
+
+# Search results requested per page, and the size of the queues between
+# the list, fetch, pre-filter and extract stages
+LIST_PAGE_SIZE = 100
+PIPELINE_QUEUE_SIZE = 100
+
+# Emails sent to the email parser at the same time
+EXTRACT_CONCURRENCY = int(os.getenv('IRIS_EXTRACT_CONCURRENCY', '4'))
+
+# Incremental sync checkpoints. Gmail keeps history records for at least
+# a week, so older checkpoints fall back to a full scan of days_back.
+SYNC_STATE_FILE = os.getenv('GMAIL_SYNC_STATE_FILE', 'gmail_sync_state.json')
+SYNC_CHECKPOINT_MAX_AGE = timedelta(days=7)
+SYNC_MAX_PROCESSED_IDS = 10000  # Most recent message ids kept for dedup
+# Incremental syncs search from this long before the checkpoint, to allow
+# for delivery delays and clock skew
+SYNC_SEARCH_MARGIN = timedelta(days=1)
+
+# Fetch subjects first and download full bodies only for messages whose
+# subject passes the exclusion check
+TWO_PHASE_FETCH = os.getenv('GMAIL_TWO_PHASE_FETCH', 'true').lower() in ('1', 'true', 'yes')
+
+# Email parser decisions are appended here as classifier training data
+CLASSIFIER_LOG = os.getenv('IRIS_CLASSIFIER_LOG')
+
+# googleapiclient is imported where HttpError is caught rather than at the
+# top, so importing this module does not load the Google client stack
+
+def get_gmail_service(token_file: str = TOKEN_FILE):
+    """Gets a Gmail service for the stored credentials, built once per process and kept authorized."""
+    return gmail_services.get(token_file)
+
+class _HTMLText(HTMLParser):
+    """Collects the visible text of an HTML document, one line per block."""
+
+    BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'li', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.chunks.append(data)
+
+def html_to_text(html: str) -> str:
+    """Convert an HTML body to plain text."""
+    parser = _HTMLText()
+    parser.feed(html)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.chunks).splitlines())
+    return '\n'.join(line for line in lines if line)
 
-    return build('gmail', 'v1', credentials=creds)
+def _header(headers: List[Dict], name: str) -> Optional[str]:
+    name = name.lower()
+    return next((h['value'] for h in headers if h['name'].lower() == name), None)
+
+def get_email_subject(message) -> str:
+    """Subject of a Gmail message fetched in any format, including 'metadata'."""
+    headers = message.get('payload', {}).get('headers', [])
+    return _header(headers, 'Subject') or 'No Subject'
+
+def _iter_parts(payload: Dict):
+    """Yield the parts of a MIME tree depth-first, in document order."""
+    yield payload
+    for part in payload.get('parts', []):
+        yield from _iter_parts(part)
+
+def _is_attachment(part: Dict) -> bool:
+    disposition = _header(part.get('headers', []), 'Content-Disposition') or ''
+    return bool(part.get('filename')) or disposition.lower().startswith('attachment')
+
+def _decode_part(part: Dict) -> Optional[str]:
+    """Decode a text part's body using its declared charset."""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return None
+    raw = base64.urlsafe_b64decode(data)
+    content_type = _header(part.get('headers', []), 'Content-Type') or ''
+    charset = re.search(r'charset="?([^";\s]+)', content_type, re.IGNORECASE)
+    try:
+        return raw.decode(charset.group(1) if charset else 'utf-8', errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')  # Unknown charset name
 
 def get_email_content(message):
-    """Extract the email content from a Gmail message."""
+    """Extract the subject and text body from a Gmail message.
+
+    The MIME tree is walked depth-first for the first text/plain part, or
+    failing that the first text/html part converted to text. Attachments
+    are skipped, and only the chosen part is decoded. Returns None if the
+    message has no text body, e.g. when it was fetched with format='metadata'.
+    """
     if 'payload' not in message:
         return None
     
-    payload = message['payload']
-    headers = payload.get('headers', [])
-    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+    html_part = None
+    text = None
+    for part in _iter_parts(message['payload']):
+        if _is_attachment(part):
+            continue
+        mime_type = part.get('mimeType', 'text/plain')
+        if mime_type == 'text/plain':
+            text = _decode_part(part)
+            if text:
+                break
+        elif mime_type == 'text/html' and html_part is None:
+            html_part = part
     
-    if 'parts' in payload:
-        parts = payload['parts']
-        data = parts[0]['body'].get('data', '')
-    else:
-        data = payload['body'].get('data', '')
-    
-    if not data:
+    if not text and html_part is not None:
+        html = _decode_part(html_part)
+        text = html_to_text(html) if html else None
+    if not text:
         return None
-    
-    text = base64.urlsafe_b64decode(data).decode('utf-8')
-    return {'subject': subject, 'body': text}
+    return {'subject': get_email_subject(message), 'body': text}
+
+# A service sends every request through one httplib2.Http, which is not
+# thread safe, so calls on the same service are made one at a time even
+# when the list and fetch stages run them from different worker threads
+_service_locks = weakref.WeakKeyDictionary()
+_service_locks_guard = threading.Lock()
+
+def _service_lock(service) -> threading.Lock:
+    with _service_locks_guard:
+        return _service_locks.setdefault(service, threading.Lock())
+
+async def _call_gmail(service, function, *args):
+    """Run a blocking Gmail call in a worker thread, holding the service's lock."""
+    lock = _service_lock(service)
+
+    def locked_call():
+        with lock:
+            return function(*args)
+    return await asyncio.to_thread(locked_call)
 
-def is_travel_related(email_content: Dict) -> bool:
-    """Check if an email is travel-related based on subject and content."""
-    if not email_content:
+def _is_retryable_error(error: Exception) -> bool:
+    """Check if a Gmail API error is a rate limit or transient backend error."""
+    from googleapiclient.errors import HttpError
+    if not isinstance(error, HttpError):
         return False
-    
-    subject = email_content['subject'].lower()
-    body = email_content['body'].lower()
-    
-    # First check if it's a promotional or tracking email
-    for exclusion in TRAVEL_KEYWORDS['exclusion_words']:
-        if exclusion in subject.lower():
+    status = error.resp.status
+    if status == 403:
+        return 'rateLimitExceeded' in str(error) or 'userRateLimitExceeded' in str(error)
+    return status in (429, 500, 503)
+
+def _execute_batch(service, message_ids: List[str], message_format: str = 'full',
+                   metadata_headers: Optional[List[str]] = None) -> Tuple[Dict[str, dict], Dict[str, Exception]]:
+    """Fetch a group of messages with a single batch HTTP request."""
+    messages = {}
+    errors = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            messages[request_id] = response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for message_id in message_ids:
+        if message_format == 'metadata':
+            request = service.users().messages().get(userId='me', id=message_id, format=message_format,
+                                                     metadataHeaders=metadata_headers or ['Subject'])
+        else:
+            request = service.users().messages().get(userId='me', id=message_id, format=message_format)
+        batch.add(request, request_id=message_id)
+    from googleapiclient.errors import HttpError
+    try:
+        batch.execute()
+    except HttpError as e:
+        # The whole batch was rejected, e.g. by a rate limit
+        for message_id in message_ids:
+            if message_id not in messages:
+                errors[message_id] = e
+    return messages, errors
+
+async def fetch_messages(
+    service,
+    message_ids: List[str],
+    batch_size: int = FETCH_BATCH_SIZE,
+    message_format: str = 'full',
+    max_retries: int = FETCH_MAX_RETRIES,
+    initial_backoff: float = FETCH_INITIAL_BACKOFF,
+    metadata_headers: Optional[List[str]] = None,
+    stats: Optional[Dict] = None
+) -> Tuple[List[Dict], List[str]]:
+    """Fetch Gmail messages in batches without blocking the event loop.
+
+    Each group of batch_size messages is sent as one batch HTTP request from
+    a worker thread. With message_format='metadata' only the headers in
+    metadata_headers (by default the subject) are fetched. If stats is
+    given, batch requests, messages, response bytes and seconds are added
+    to it. Messages that hit a rate limit are retried with
+    exponential backoff. Other failures are reported and skipped. Returns
+    the fetched messages in the order of message_ids, and the ids that
+    could not be fetched.
+    """
+    message_ids = list(dict.fromkeys(message_ids))  # Batch request ids must be unique
+    fetched = {}
+
+    for start in range(0, len(message_ids), batch_size):
+        pending = message_ids[start:start + batch_size]
+        delay = initial_backoff
+
+        for attempt in range(max_retries + 1):
+            started = time.perf_counter()
+            messages, errors = await _call_gmail(service, _execute_batch, service, pending, message_format,
+                                                 metadata_headers)
+            fetched.update(messages)
+            if stats is not None:
+                stats['requests'] += 1
+                stats['messages'] += len(messages)
+                stats['seconds'] += time.perf_counter() - started
+                # Size of the decoded responses, close to the bytes received
+                stats['bytes'] += sum(len(json.dumps(msg)) for msg in messages.values())
+
+            pending = []
+            for message_id, error in errors.items():
+                if _is_retryable_error(error):
+                    pending.append(message_id)
+                else:
+                    print(f"Error fetching message {message_id}: {error}")
+
+            if not pending:
+                break
+            if attempt == max_retries:
+                print(f"Giving up on {len(pending)} messages after {max_retries} retries")
+                break
+
+            print(f"Rate limited on {len(pending)} messages, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay + random.uniform(0, delay))  # Add jitter
+            delay *= 2
+
+    failed = [message_id for message_id in message_ids if message_id not in fetched]
+    return [fetched[message_id] for message_id in message_ids if message_id in fetched], failed
+
+def new_fetch_stats() -> Dict:
+    """Counters for the metadata and full fetch phases, and for the bodies skipped by subject."""
+    phase = {'requests': 0, 'messages': 0, 'bytes': 0, 'seconds': 0.0}
+    return {'metadata': dict(phase), 'full': dict(phase), 'skipped_by_subject': 0, 'bytes_skipped': 0}
+
+async def triage_by_subject(service, message_ids: List[str], batch_size: int = FETCH_BATCH_SIZE,
+                            stats: Optional[Dict] = None) -> Tuple[List[str], List[str], List[str]]:
+    """Fetch subjects with format='metadata' and split ids into (candidates, excluded, failed)."""
+    headers, failed = await fetch_messages(service, message_ids, batch_size, message_format='metadata',
+                                   stats=stats['metadata'] if stats else None)
+    candidates = []
+    excluded = []
+    for msg in headers:
+        subject = get_email_subject(msg)
+        if is_excluded_subject(subject):
             print(f"Skipping promotional/tracking email: {subject}")
-            return False
-    
-    # Check for booking confirmation indicators
-    has_booking_indicator = False
-    for indicator in TRAVEL_KEYWORDS['booking_indicators']:
-        if indicator in subject.lower() or indicator in body.lower():
-            has_booking_indicator = True
-            break
+            excluded.append(msg['id'])
+            if stats is not None:
+                stats['skipped_by_subject'] += 1
+                stats['bytes_skipped'] += msg.get('sizeEstimate', 0)
+        else:
+            candidates.append(msg['id'])
+    return candidates, excluded, failed
+
+async def iter_message_ids(service, query: str, max_results: Optional[int] = None, page_size: int = LIST_PAGE_SIZE) -> AsyncIterator[str]:
+    """Yield ids of messages matching query, following page tokens as pages arrive."""
+    page_token = None
+    yielded = 0
     
-    if not has_booking_indicator:
-        print(f"Skipping email without booking indicators: {subject}")
-        return False
+    while True:
+        page_limit = page_size if max_results is None else min(page_size, max_results - yielded)
+        request = service.users().messages().list(
+            userId='me',
+            q=query,
+            maxResults=page_limit,
+            pageToken=page_token
+        )
+        results = await _call_gmail(service, request.execute)
+        
+        for message in results.get('messages', []):
+            yield message['id']
+            yielded += 1
+            if max_results is not None and yielded >= max_results:
+                return
+        
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+def load_sync_checkpoint(user_id: str, state_file: str = SYNC_STATE_FILE) -> Optional[Dict]:
+    """Load a user's sync checkpoint: last historyId and processed message ids."""
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f).get(user_id)
+
+def save_sync_checkpoint(user_id: str, checkpoint: Dict, state_file: str = SYNC_STATE_FILE):
+    """Save a user's sync checkpoint, replacing the state file atomically."""
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    state[user_id] = checkpoint
     
-    # Check if the email contains future dates
-    has_future, next_date = has_future_dates(email_content)
-    if not has_future:
-        print(f"Skipping email with no future dates: {subject}")
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def _is_checkpoint_current(checkpoint: Optional[Dict]) -> bool:
+    if not checkpoint or not checkpoint.get('history_id'):
         return False
-    else:
-        print(f"Found future date: {next_date.strftime('%Y-%m-%d %H:%M')} in: {subject}")
+    updated_at = datetime.fromisoformat(checkpoint['updated_at'])
+    return datetime.now() - updated_at < SYNC_CHECKPOINT_MAX_AGE
+
+async def iter_history_message_ids(service, start_history_id: str) -> AsyncIterator[str]:
+    """Yield ids of messages added since start_history_id, following page tokens.
+
+    Raises HttpError with status 404 if the history id is too old.
+    """
+    page_token = None
     
-    # Now check for specific travel categories
-    for category in ['transportation', 'accommodation', 'activities']:
-        for keyword in TRAVEL_KEYWORDS[category]:
-            if keyword in subject.lower() or keyword in body.lower():
-                # Look for patterns that suggest this is a real booking
-                patterns = [
-                    r'booking\s*(#|number|ref|reference|confirmation)?[:. ]*[A-Z0-9]{6,}',  # Booking reference
-                    r'confirmation\s*(#|number|code)?[:. ]*[A-Z0-9]{6,}',  # Confirmation number
-                    r'reservation\s*(#|number)?[:. ]*[A-Z0-9]{6,}',  # Reservation number
-                    r'itinerary\s*(#|number)?[:. ]*[A-Z0-9]{6,}',   # Itinerary number
-                    r'\b[A-Z]{2}\d{3,4}\b',  # Flight number pattern
-                    r'\d{1,2}[-/]\d{1,2}[-/]\d{2,4}.*\d{1,2}[:. ]\d{2}',  # Date and time pattern
-                    r'check-?in:?\s*\d{1,2}[-/]\d{1,2}',  # Check-in date pattern
-                    r'total:?\s*[\$€£]?\d+[.,]\d{2}',  # Price/total pattern
-                ]
-                
-                for pattern in patterns:
-                    if re.search(pattern, body, re.IGNORECASE):
-                        print(f"Found future booking in category {category}: {subject}")
-                        return True
+    while True:
+        request = service.users().history().list(
+            userId='me',
+            startHistoryId=start_history_id,
+            historyTypes=['messageAdded'],
+            pageToken=page_token
+        )
+        results = await _call_gmail(service, request.execute)
+        
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                yield added['message']['id']
+        
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return
+
+async def _iter_sync_message_ids(service, query: str, checkpoint: Optional[Dict]) -> AsyncIterator[str]:
+    """Yield new message ids matching query.
+
+    With a current checkpoint, only messages the history API reports as
+    added since it are yielded, and only those a search for query from
+    shortly before the checkpoint also returns, so an incremental run picks
+    the same emails a full scan would. Otherwise query is searched in full.
+    """
+    from googleapiclient.errors import HttpError
+    if _is_checkpoint_current(checkpoint):
+        print(f"\nSyncing changes since history id {checkpoint['history_id']}")
+        added = set()
+        try:
+            async for message_id in iter_history_message_ids(service, checkpoint['history_id']):
+                added.add(message_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print("Sync checkpoint has expired, falling back to a full scan")
+        else:
+            if not added:
+                return
+            since = datetime.fromisoformat(checkpoint.get('history_read_at', checkpoint['updated_at']))
+            since -= SYNC_SEARCH_MARGIN
+            async for message_id in iter_message_ids(service, f"{query} after:{int(since.timestamp())}"):
+                if message_id in added:
+                    yield message_id
+            return
     
-    print(f"Skipping email that doesn't match booking patterns: {subject}")
-    return False
+    async for message_id in iter_message_ids(service, query):
+        yield message_id
 
-async def process_gmail_emails(user_id: str, days_back: int = 90, max_results: int = 50):
-    """Process recent travel-related emails from Gmail."""
-    service = get_gmail_service()
+async def _list_stage(service, query: str, max_results: Optional[int], checkpoint: Optional[Dict],
+                      processed_ids: Dict[str, None], id_queue: asyncio.Queue, counters: Dict):
+    # max_results counts new emails only, so a capped run picks up where the last one stopped
+    queued = set()
+    async for message_id in _iter_sync_message_ids(service, query, checkpoint):
+        if message_id in processed_ids:
+            counters['already_processed'] += 1
+            continue
+        if message_id in queued:
+            continue
+        if max_results is not None and len(queued) >= max_results:
+            counters['truncated'] = True
+            break
+        queued.add(message_id)
+        counters['listed'] += 1
+        await id_queue.put(message_id)
+    await id_queue.put(None)
+
+async def _fetch_stage(service, id_queue: asyncio.Queue, message_queue: asyncio.Queue, batch_size: int,
+                       processed_ids: Dict[str, None], fetch_stats: Dict, two_phase: bool, counters: Dict):
+    done = False
+    while not done:
+        # Wait for one id, then take whatever else is queued up to a full batch
+        message_id = await id_queue.get()
+        if message_id is None:
+            break
+        batch = [message_id]
+        while len(batch) < batch_size and not id_queue.empty():
+            message_id = id_queue.get_nowait()
+            if message_id is None:
+                done = True
+                break
+            batch.append(message_id)
+        
+        if two_phase:
+            batch, excluded, failed = await triage_by_subject(service, batch, batch_size, fetch_stats)
+            processed_ids.update(dict.fromkeys(excluded))
+            counters['fetch_failed'] += len(failed)
+        messages, failed = await fetch_messages(service, batch, batch_size, stats=fetch_stats['full'])
+        counters['fetch_failed'] += len(failed)
+        for msg in messages:
+            await message_queue.put(msg)
+    await message_queue.put(None)
+
+async def _filter_stage(message_queue: asyncio.Queue, candidate_queue: asyncio.Queue, processed_ids: Dict[str, None],
+                        pre_filter: FilterPipeline, classifier: Optional[EmailClassifier], counters: Dict):
+    while (msg := await message_queue.get()) is not None:
+        email_content = get_email_content(msg)
+        if email_content and pre_filter(email_content):
+            if classifier is not None and not classifier.should_extract(email_content):
+                print(f"Skipping email the classifier scored as a non-booking: {email_content['subject']}")
+                counters['classifier_skipped'] += 1
+                processed_ids[msg['id']] = None
+                continue
+            await candidate_queue.put((msg['id'], email_content))
+        else:
+            print(f"Skipping non-booking or past email: {email_content['subject'] if email_content else 'No subject'}")
+            processed_ids[msg['id']] = None
+    await candidate_queue.put(None)
+
+async def _extract_stage(user_id: str, candidate_queue: asyncio.Queue, processed_emails: List[Dict], processed_ids: Dict[str, None],
+                         llm_slots):
+    while True:
+        candidate = await candidate_queue.get()
+        if candidate is None:
+            # Pass the end marker on to the other extract workers
+            await candidate_queue.put(None)
+            break
+        message_id, email_content = candidate
+        print(f"\nProcessing future booking email: {email_content['subject']}")
+        items = []
+        try:
+            async with llm_slots or contextlib.nullcontext():
+                result = await process_travel_email(user_id, email_content['body'], items=items)
+        except Exception as e:
+            # Leave the id out of processed_ids so the next run retries it
+            print(f"Error processing email {email_content['subject']}: {e}")
+            processed_emails.append({
+                'subject': email_content['subject'],
+                'result': None,
+                'error': str(e)
+            })
+            continue
+        if CLASSIFIER_LOG:
+            log_decision(CLASSIFIER_LOG, email_content, bool(items))
+        processed_emails.append({
+            'subject': email_content['subject'],
+            'result': result,
+            'error': None
+        })
+        processed_ids[message_id] = None
+
+class SyncOptions(NamedTuple):
+    """Settings for a sync that runs alongside others, used by mailbox_scheduler.
+
+    llm_slots is an async context manager entered around every email
+    parser call, so concurrent runs share one limit. defer_writes lets a
+    backfill persist the store once at the end; turn it off when runs share
+    the store, as deferred writes are only flushed once all of them finish.
+    stats, if given, is filled with the run's queues and counters as soon
+    as it starts, so they can be watched while it goes.
+    """
+    llm_slots: Optional[contextlib.AbstractAsyncContextManager] = None
+    defer_writes: bool = True
+    stats: Optional[Dict] = None
+
+async def process_gmail_emails(
+    user_id: str,
+    days_back: int = 90,
+    max_results: Optional[int] = None,
+    service=None,
+    batch_size: int = FETCH_BATCH_SIZE,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    extract_concurrency: int = EXTRACT_CONCURRENCY,
+    full_sync: bool = False,
+    state_file: str = SYNC_STATE_FILE,
+    filter_stages: Optional[List[str]] = None,
+    classifier: Optional[EmailClassifier] = None,
+    two_phase: bool = TWO_PHASE_FETCH,
+    options: SyncOptions = SyncOptions()
+):
+    """Sync a user's recent travel booking emails from Gmail and return the processed ones.
+
+    Runs are incremental from the checkpoint in state_file unless full_sync
+    is set; a service object (or a fake) can be passed in place of Gmail.
+    """
+    if service is None:
+        service = get_gmail_service()
     
     # Calculate date range
     after_date = (datetime.now() - timedelta(days=days_back)).strftime('%Y/%m/%d')
@@ -249,34 +545,85 @@ async def process_gmail_emails(user_id: str, days_back: int = 90, max_results: i
     print("- Only processing bookings with future dates")
     print(f"\nSearch query: {query}")
     
-    # Get emails matching the query
-    results = service.users().messages().list(
-        userId='me',
-        q=query,
-        maxResults=max_results
-    ).execute()
+    checkpoint = load_sync_checkpoint(user_id, state_file) or {}
+    processed_ids = dict.fromkeys(checkpoint.get('processed_ids', []))
     
-    messages = results.get('messages', [])
+    # Read the mailbox position before listing, so messages that arrive
+    # during this run are picked up by the next one
+    profile = await _call_gmail(service, service.users().getProfile(userId='me').execute)
+    history_id = profile['historyId']
+    history_read_at = datetime.now()
+    
+    id_queue = asyncio.Queue(maxsize=queue_size)
+    message_queue = asyncio.Queue(maxsize=queue_size)
+    candidate_queue = asyncio.Queue(maxsize=queue_size)
+    counters = {'listed': 0, 'already_processed': 0, 'classifier_skipped': 0, 'fetch_failed': 0,
+                'truncated': False}
     processed_emails = []
+    pre_filter = FilterPipeline(filter_stages or stage_order_from_env())
+    fetch_stats = new_fetch_stats()
+    if classifier is None:
+        classifier = load_classifier()
+    if options.stats is not None:
+        options.stats.update(
+            queues={'ids': id_queue, 'messages': message_queue, 'candidates': candidate_queue},
+            counters=counters,
+            fetch=fetch_stats
+        )
     
-    print(f"\nFound {len(messages)} potential travel emails")
+    tasks = [
+        asyncio.create_task(_list_stage(service, query, max_results, None if full_sync else checkpoint,
+                                        processed_ids, id_queue, counters)),
+        asyncio.create_task(_fetch_stage(service, id_queue, message_queue, batch_size,
+                                         processed_ids, fetch_stats, two_phase, counters)),
+        asyncio.create_task(_filter_stage(message_queue, candidate_queue, processed_ids, pre_filter, classifier, counters)),
+    ] + [
+        asyncio.create_task(_extract_stage(user_id, candidate_queue, processed_emails, processed_ids,
+                                      options.llm_slots))
+        for _ in range(extract_concurrency)
+    ]
+    # A backfill makes many writes, so the store persists them once at the
+    # end, before the checkpoint records the emails as processed
+    backfill = options.defer_writes and (full_sync or not _is_checkpoint_current(checkpoint))
+    completed = False
+    try:
+        with app.store.deferred_flush() if backfill else contextlib.nullcontext():
+            try:
+                await asyncio.gather(*tasks)
+                # Emails that were not fetched or failed are not in
+                # processed_ids; keeping the old history position lets the
+                # next run list them again
+                failed = counters['fetch_failed'] + sum(1 for email in processed_emails if email['error'])
+                if failed:
+                    print(f"\n{failed} emails failed and will be retried on the next sync")
+                if counters['truncated']:
+                    print(f"\nStopped at {max_results} emails; the next sync continues from there")
+                completed = not failed and not counters['truncated']
+            finally:
+                # If one stage fails, stop the others instead of leaving them blocked
+                for task in tasks:
+                    task.cancel()
+    finally:
+        # Only move the history position forward after a complete run, but
+        # always keep the ids that were handled so a retry can skip them
+        if completed:
+            checkpoint = {'history_id': history_id, 'history_read_at': history_read_at.isoformat(),
+                          'updated_at': datetime.now().isoformat()}
+        checkpoint['processed_ids'] = list(processed_ids)[-SYNC_MAX_PROCESSED_IDS:]
+        save_sync_checkpoint(user_id, checkpoint, state_file)
     
-    for message in messages:
-        msg = service.users().messages().get(
-            userId='me',
-            id=message['id']
-        ).execute()
-        
-        email_content = get_email_content(msg)
-        if email_content and is_travel_related(email_content):
-            print(f"\nProcessing future booking email: {email_content['subject']}")
-            result = await process_travel_email(user_id, email_content['body'])
-            processed_emails.append({
-                'subject': email_content['subject'],
-                'result': result
-            })
-        else:
-            print(f"Skipping non-booking or past email: {email_content['subject'] if email_content else 'No subject'}")
+    print(f"\nFound {counters['listed']} potential travel emails ({counters['already_processed']} already processed)")
+    for phase in ('metadata', 'full'):
+        phase_stats = fetch_stats[phase]
+        if phase_stats['requests']:
+            print(f"Fetched {phase_stats['messages']} {phase} messages in {phase_stats['requests']} batches: "
+                  f"{phase_stats['bytes'] / 1024:.1f} KB in {phase_stats['seconds']:.2f}s")
+    if two_phase:
+        print(f"Skipped {fetch_stats['skipped_by_subject']} bodies by subject "
+              f"({fetch_stats['bytes_skipped'] / 1024:.1f} KB not downloaded)")
+    pre_filter.report()
+    if classifier is not None:
+        print(f"Classifier skipped {counters['classifier_skipped']} emails below threshold {classifier.threshold}")
     
     return processed_emails
 
@@ -287,11 +634,21 @@ async def main():
     processed_emails = await process_gmail_emails(user_id, days_back=90)
     
     print(f"\nProcessed {len(processed_emails)} travel-related emails")
+    if app.extraction_cache is not None:
+        stats = app.extraction_cache.stats()
+        print(f"Extraction cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+    if template_registry is not None:
+        stats = template_registry.stats()
+        print(f"Template extractors: {stats['hit_rate']:.0%} of {stats['emails']} emails extracted without the model")
+        for name, template_stats in stats['templates'].items():
+            print(f"- {name}: {template_stats['hits']} ({template_stats['hit_rate']:.0%})")
+    if email_trimmer is not None:
+        stats = email_trimmer.stats()
+        print(f"Prompt trimming: {stats['tokens_saved']} of {stats['original_tokens']} tokens saved "
+              f"over {stats['emails']} emails")
     
-    print("\nGetting travel summary...")
-    summary = await get_travel_summary(user_id)
     print("\nTravel Summary:")
-    print(summary)
+    print(format_itinerary(user_id))
 
 if __name__ == '__main__':
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,91 @@
+from bisect import bisect_right, insort
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Itinerary groups, in display order
+GROUPS = {'flight': 'flights', 'hotel': 'hotels', 'activity': 'activities'}
+
+
+class ItineraryView:
+    """Materialized itinerary of one user's confirmed items.
+
+    Items are kept sorted by start time, and overlaps between them are
+    tracked as they are added, so reading the upcoming itinerary is a
+    slice instead of a scan. Items are identified by a backend key (a list
+    position or row id). Hotel stays only conflict with other stays, since
+    flights and activities during a stay are expected.
+    """
+
+    def __init__(self, parse_time: Callable[[str], datetime]):
+        self._parse_time = parse_time
+        self._items: Dict[int, Tuple[datetime, datetime, dict]] = {}
+        self._order: List[Tuple[datetime, int]] = []
+        self._conflicts: Dict[int, Set[int]] = {}
+
+    def _span(self, item: dict) -> Tuple[datetime, datetime]:
+        start = self._parse_time(item['start_time'])
+        end = self._parse_time(item['end_time']) if item.get('end_time') else start
+        return start, max(start, end)
+
+    def _overlaps(self, a: Tuple[datetime, datetime, dict], b: Tuple[datetime, datetime, dict]) -> bool:
+        if (a[2]['type'] == 'hotel') != (b[2]['type'] == 'hotel'):
+            return False
+        if a[0] == datetime.max or b[0] == datetime.max:
+            return False  # Unknown times cannot be checked
+        return a[0] == b[0] or (a[0] < b[1] and b[0] < a[1])
+
+    def update(self, key: int, item: Optional[dict]):
+        """Apply an add, update or cancellation of the item stored under key."""
+        self.remove(key)
+        if item is None or item.get('details', {}).get('booking_status') != 'confirmed':
+            return
+
+        start, end = self._span(item)
+        entry = (start, end, item)
+        conflicts = set()
+        # Only items starting no later than this one ends can overlap it
+        for other_start, other_key in self._order[:bisect_right(self._order, (end, float('inf')))]:
+            if self._overlaps(entry, self._items[other_key]):
+                conflicts.add(other_key)
+                self._conflicts[other_key].add(key)
+        self._items[key] = entry
+        self._conflicts[key] = conflicts
+        insort(self._order, (start, key))
+
+    def remove(self, key: int):
+        entry = self._items.pop(key, None)
+        if entry is None:
+            return
+        self._order.remove((entry[0], key))
+        for other_key in self._conflicts.pop(key):
+            self._conflicts[other_key].discard(key)
+
+    def snapshot(self, now: Optional[datetime] = None) -> Dict:
+        """Upcoming items grouped by type in chronological order, with the conflicts between them."""
+        now = now or datetime.now()
+        upcoming = self._order[bisect_right(self._order, (now, float('inf'))):]
+        view = {group: [] for group in GROUPS.values()}
+        upcoming_keys = set()
+        for _, key in upcoming:
+            item = self._items[key][2]
+            view[GROUPS[item['type']]].append(item)
+            upcoming_keys.add(key)
+
+        conflicts = []
+        for _, key in upcoming:
+            for other_key in sorted(self._conflicts[key], key=lambda k: (self._items[k][0], k)):
+                # Each pair once, in start order
+                if other_key in upcoming_keys and (self._items[other_key][0], other_key) > (self._items[key][0], key):
+                    conflicts.append([self._summary(key), self._summary(other_key)])
+        view['conflicts'] = conflicts
+        return view
+
+    def _summary(self, key: int) -> Dict:
+        start, end, item = self._items[key]
+        return {
+            'type': item['type'],
+            'description': item['description'],
+            'start_time': item['start_time'],
+            'end_time': item.get('end_time'),
+            'confirmation_number': item.get('details', {}).get('confirmation_number')
+        }
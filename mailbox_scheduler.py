@@ -0,0 +1,279 @@
+"""Sync many Gmail mailboxes from one process.
+
+Each mailbox is synced with process_gmail_emails on a pool of asyncio
+workers. Mailboxes wait in a round-robin queue, so every mailbox gets a
+turn before any mailbox gets a second one, and a mailbox is never synced
+twice at once. The workers cap how many mailboxes sync at the same time,
+and extract_concurrency caps the email parser calls of each one. All runs
+share one set of LLM slots; when every slot is busy and llm_backlog
+emails are already waiting for one, workers hold off starting more
+mailboxes until the backlog drains.
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from gmail_auth import gmail_services
+from gmail_integration import EXTRACT_CONCURRENCY, SYNC_STATE_FILE, SyncOptions, process_gmail_emails
+
+load_dotenv()
+
+MAX_CONCURRENT_MAILBOXES = int(os.getenv('IRIS_MAX_CONCURRENT_MAILBOXES', '4'))
+LLM_CONCURRENCY = int(os.getenv('IRIS_LLM_CONCURRENCY', '8'))
+LLM_BACKLOG = int(os.getenv('IRIS_LLM_BACKLOG', '16'))
+
+
+class Mailbox:
+    """A user's mailbox and the token file its Gmail service is built from."""
+
+    def __init__(self, user_id: str, token_file: Optional[str] = None, service=None):
+        self.user_id = user_id
+        self.token_file = token_file or f"token_{user_id}.json"
+        self.service = service
+        self.runs = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+
+class LLMSlots:
+    """Shared limit on email parser calls that also counts the calls waiting for it."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._released = asyncio.Condition()
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self._semaphore.release()
+        async with self._released:
+            self._released.notify_all()
+
+    async def wait_for_capacity(self, backlog: int):
+        """Wait until fewer than backlog calls are waiting for a slot."""
+        async with self._released:
+            await self._released.wait_for(lambda: self.waiting < backlog)
+
+
+class MailboxScheduler:
+    """Runs process_gmail_emails for many mailboxes on a pool of async workers.
+
+    Each sync asks service_factory for the mailbox's service. The default,
+    gmail_services, builds it once and reuses it for every later sync, so
+    its HTTP connections stay open and its token is refreshed before it
+    expires. A failed sync drops the cached service, so the next one
+    builds a fresh one. Fake services can be passed to add_mailbox for
+    testing.
+    """
+
+    def __init__(
+        self,
+        service_factory: Optional[Callable[[Mailbox], object]] = None,
+        max_concurrent_mailboxes: int = MAX_CONCURRENT_MAILBOXES,
+        extract_concurrency: int = EXTRACT_CONCURRENCY,
+        llm_concurrency: int = LLM_CONCURRENCY,
+        llm_backlog: int = LLM_BACKLOG,
+        days_back: int = 90,
+        max_results: Optional[int] = None,
+        state_file: str = SYNC_STATE_FILE,
+        **sync_options
+    ):
+        self.service_factory = service_factory or (lambda mailbox: gmail_services.get(mailbox.token_file))
+        self.max_concurrent_mailboxes = max_concurrent_mailboxes
+        self.extract_concurrency = extract_concurrency
+        self.llm_concurrency = llm_concurrency
+        self.llm_backlog = llm_backlog
+        self.days_back = days_back
+        self.max_results = max_results
+        self.state_file = state_file
+        self.sync_options = sync_options
+        self.mailboxes: Dict[str, Mailbox] = {}
+        self._queue: Deque[str] = deque()
+        self._queued = set()
+        self._ready: Optional[asyncio.Condition] = None
+        self._llm_slots: Optional[LLMSlots] = None
+        self._active: Dict[str, Dict] = {}  # Live stats of the syncs in progress
+        self._started: Optional[float] = None
+        self.emails = 0  # Emails taken in by finished syncs
+        self.processed = 0  # Emails the parser ran on in finished syncs
+        self.runs = 0
+        self.failures = 0
+
+    def add_mailbox(self, user_id: str, token_file: Optional[str] = None, service=None) -> Mailbox:
+        """Register a mailbox to sync. Its service is built on first sync unless one is given."""
+        mailbox = Mailbox(user_id, token_file, service)
+        self.mailboxes[user_id] = mailbox
+        return mailbox
+
+    def _enqueue(self, user_id: str):
+        # A mailbox is queued at most once, so it cannot run twice at once
+        # or take more than one turn per round
+        if user_id not in self._queued:
+            self._queued.add(user_id)
+            self._queue.append(user_id)
+
+    async def _sync(self, mailbox: Mailbox) -> Optional[List[Dict]]:
+        run_stats = {}
+        self._active[mailbox.user_id] = run_stats
+        try:
+            service = mailbox.service or await asyncio.to_thread(self.service_factory, mailbox)
+            return await process_gmail_emails(
+                mailbox.user_id,
+                days_back=self.days_back,
+                max_results=self.max_results,
+                service=service,
+                extract_concurrency=self.extract_concurrency,
+                state_file=self.state_file,
+                options=SyncOptions(
+                    llm_slots=self._llm_slots,
+                    # Deferred writes of one run are only flushed when every
+                    # run has finished, after the checkpoint was already saved
+                    defer_writes=self.max_concurrent_mailboxes == 1,
+                    stats=run_stats
+                ),
+                **self.sync_options
+            )
+        except Exception as e:
+            print(f"Sync failed for {mailbox.user_id}: {e}")
+            mailbox.failures += 1
+            mailbox.last_error = str(e)
+            gmail_services.invalidate(mailbox.token_file)
+            self.failures += 1
+            return None
+        finally:
+            mailbox.runs += 1
+            self.runs += 1
+            if 'counters' in run_stats:
+                self.emails += run_stats['counters']['listed']
+            del self._active[mailbox.user_id]
+
+    async def _worker(self, results: Dict[str, Optional[List[Dict]]], interval: Optional[float]):
+        while True:
+            async with self._ready:
+                # Without an interval nothing is requeued, so an empty queue means done
+                await self._ready.wait_for(lambda: self._queue or interval is None)
+                if not self._queue:
+                    return
+                user_id = self._queue.popleft()
+                self._queued.discard(user_id)
+            # Backpressure: more mailboxes would only add to the parser backlog
+            await self._llm_slots.wait_for_capacity(self.llm_backlog)
+
+            processed = await self._sync(self.mailboxes[user_id])
+            results[user_id] = processed
+            if processed:
+                self.processed += len(processed)
+            if interval is not None:
+                asyncio.get_running_loop().call_later(interval, self._requeue, user_id)
+
+    def _requeue(self, user_id: str):
+        async def notify():
+            async with self._ready:
+                self._enqueue(user_id)
+                self._ready.notify_all()
+        asyncio.ensure_future(notify())
+
+    async def run(self, user_ids: Optional[List[str]] = None, interval: Optional[float] = None) -> Dict[str, Optional[List[Dict]]]:
+        """Sync the given mailboxes (all by default) and return each one's processed emails.
+
+        Every mailbox is synced once, and None is returned for those that
+        failed. With an interval, each mailbox is synced again that many
+        seconds after its last sync finished, until the task is cancelled.
+        """
+        self._ready = asyncio.Condition()
+        self._llm_slots = LLMSlots(self.llm_concurrency)
+        self._started = time.perf_counter()
+        for user_id in user_ids or list(self.mailboxes):
+            self._enqueue(user_id)
+        results: Dict[str, Optional[List[Dict]]] = {}
+        workers = [asyncio.create_task(self._worker(results, interval)) for _ in range(self.max_concurrent_mailboxes)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return results
+
+    def stats(self) -> Dict:
+        """Aggregate throughput, and the current depth of each pipeline stage summed over running syncs."""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        emails = self.emails + sum(
+            run_stats['counters']['listed'] for run_stats in self._active.values() if 'counters' in run_stats
+        )
+        queue_depths = {'mailboxes': len(self._queue), 'ids': 0, 'messages': 0, 'candidates': 0}
+        for run_stats in self._active.values():
+            for name, queue in run_stats.get('queues', {}).items():
+                queue_depths[name] += queue.qsize()
+        if self._llm_slots is not None:
+            queue_depths['llm'] = self._llm_slots.waiting
+        return {
+            "mailboxes": len(self.mailboxes),
+            "syncing": len(self._active),
+            "runs": self.runs,
+            "failures": self.failures,
+            "emails": emails,
+            "processed": self.processed,
+            "emails_per_second": emails / elapsed if elapsed else 0.0,
+            "llm_active": self._llm_slots.active if self._llm_slots is not None else 0,
+            "queue_depths": queue_depths
+        }
+
+    def report(self):
+        """Print the aggregate stats."""
+        stats = self.stats()
+        depths = ', '.join(f"{name} {depth}" for name, depth in stats['queue_depths'].items())
+        print(f"Mailboxes: {stats['syncing']} of {stats['mailboxes']} syncing, {stats['runs']} syncs "
+              f"({stats['failures']} failed), {stats['emails']} emails at {stats['emails_per_second']:.1f}/s, "
+              f"{stats['processed']} parsed")
+        print(f"Queue depths: {depths}")
+
+
+async def _report_every(scheduler: MailboxScheduler, seconds: float):
+    while True:
+        await asyncio.sleep(seconds)
+        scheduler.report()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sync travel emails from several Gmail mailboxes.")
+    parser.add_argument("mailboxes", nargs="+", metavar="USER_ID[=TOKEN_FILE]",
+                        help="Mailbox to sync; the token file defaults to token_<user_id>.json")
+    parser.add_argument("--days-back", type=int, default=90)
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_MAILBOXES)
+    parser.add_argument("--interval", type=float, help="Resync each mailbox this many seconds after it finishes")
+    parser.add_argument("--report-every", type=float, default=30.0, help="Seconds between progress reports")
+    args = parser.parse_args()
+
+    scheduler = MailboxScheduler(max_concurrent_mailboxes=args.max_concurrent, days_back=args.days_back)
+    for mailbox in args.mailboxes:
+        user_id, _, token_file = mailbox.partition("=")
+        scheduler.add_mailbox(user_id, token_file or None)
+
+    reporter = asyncio.create_task(_report_every(scheduler, args.report_every))
+    try:
+        results = await scheduler.run(interval=args.interval)
+    finally:
+        reporter.cancel()
+    for user_id, processed in results.items():
+        print(f"{user_id}: {'failed' if processed is None else f'{len(processed)} travel emails processed'}")
+    scheduler.report()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, ConfigDict
+
+# Define our data models
+class TravelDetails(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    # Common fields
+    confirmation_number: Optional[str] = Field(None, description="Booking confirmation number or ticket number")
+    booking_status: Literal['confirmed', 'cancelled', 'pending'] = Field(default='confirmed', description="Status of the booking")
+    price_paid: Optional[float] = Field(None, description="Amount paid for the booking")
+    booking_date: Optional[str] = Field(None, description="When the booking was made")
+    
+    # Flight specific
+    flight_number: Optional[str] = Field(None, description="Flight number (e.g., 'AA123')")
+    departure_airport: Optional[str] = Field(None, description="Departure airport code")
+    arrival_airport: Optional[str] = Field(None, description="Arrival airport code")
+    airline: Optional[str] = Field(None, description="Airline name")
+    
+    # Hotel specific
+    hotel_name: Optional[str] = Field(None, description="Name of the hotel")
+    room_type: Optional[str] = Field(None, description="Type of room booked")
+    check_in_time: Optional[str] = Field(None, description="Check-in time")
+    check_out_time: Optional[str] = Field(None, description="Check-out time")
+    
+    # Activity specific
+    activity_name: Optional[str] = Field(None, description="Name of the activity")
+    location: Optional[str] = Field(None, description="Location of the activity or venue")
+    ticket_type: Optional[str] = Field(None, description="Type of ticket or admission")
+
+class TravelItem(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    type: Literal['flight', 'hotel', 'activity'] = Field(..., description="Type of travel item")
+    description: str = Field(..., description="Description of the travel item")
+    start_time: str = Field(..., description="Start time of the travel item")
+    end_time: Optional[str] = Field(None, description="End time of the travel item")
+    details: TravelDetails = Field(..., description="Specific details of the travel item")
+
+class Trip(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    user_id: str = Field(..., description="ID of the user")
+    items: List[TravelItem] = Field(default_factory=list, description="List of travel items")
+
+class ExtractedItems(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    items: List[TravelItem] = Field(default_factory=list, description="Travel items to save, empty if there are none")
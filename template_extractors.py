@@ -0,0 +1,212 @@
+"""Rule-based extraction for common confirmation email templates.
+
+Many confirmations come from a few senders with fixed layouts, such as
+"Flight: AA123 / From: New York (JFK) / Confirmation number: XYZ789".
+Each registered template has a matcher, a cheap check for the layout, and
+a parser that reads its fields into a travel item. A parser gives up unless
+it can read every required field, and reports its confidence as the share
+of all the template's fields it found. Emails that no template parses with
+enough confidence are left to the email parser.
+"""
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Pattern, Tuple
+import dateutil.parser
+from models import TravelDetails, TravelItem
+
+# A parser returns its confidence and the item read. A confident parse with
+# no item is a booking that should not be stored, e.g. one in the past.
+TemplateParser = Callable[[str], Tuple[float, Optional[TravelItem]]]
+
+class Template(NamedTuple):
+    name: str
+    matcher: Pattern
+    parser: TemplateParser
+
+class TemplateMatch(NamedTuple):
+    template: str
+    confidence: float
+    items: List[TravelItem]
+
+def _field(text: str, *labels: str) -> Optional[str]:
+    """Value of the first "Label: value" line for any of labels, ignoring list dashes."""
+    for label in labels:
+        match = re.search(rf'^[ \t]*(?:-[ \t]*)?{label}[ \t]*:[ \t]*(.+?)[ \t]*$', text, re.IGNORECASE | re.MULTILINE)
+        if match:
+            return match.group(1)
+    return None
+
+def _reference(value: Optional[str]) -> Optional[str]:
+    match = re.match(r'[A-Z0-9][A-Z0-9-]{2,}', value or '')
+    return match.group(0) if match else None
+
+def _datetime(value: Optional[str], time_value: Optional[str] = None) -> Optional[datetime]:
+    if not value:
+        return None
+    if time_value:
+        # Time zone abbreviations like PDT are dropped, as dateutil cannot resolve them
+        time_match = re.match(r'\d{1,2}:\d{2}(?:\s*[AaPp][Mm])?', time_value)
+        if not time_match:
+            return None
+        value = f"{value} {time_match.group(0)}"
+    else:
+        value = re.sub(r'\s+(?!AM$|PM$)[A-Z]{2,4}$', '', value)
+    try:
+        # Stored times are local, like the email parser's
+        return dateutil.parser.parse(value).replace(tzinfo=None)
+    except (ValueError, OverflowError):
+        return None
+
+def _price(text: str) -> Optional[float]:
+    match = re.search(r'total(?: paid)?:?\s*[\$€£]?\s*(\d+(?:,\d{3})*[.,]\d{2})', text, re.IGNORECASE)
+    return float(match.group(1).replace(',', '')) if match else None
+
+def _confidence(required: Tuple, optional: Tuple) -> float:
+    """Share of fields found, or 0 if a required field is missing."""
+    if any(field is None for field in required):
+        return 0.0
+    fields = required + optional
+    return sum(field is not None for field in fields) / len(fields)
+
+def parse_flight(text: str) -> Tuple[float, Optional[TravelItem]]:
+    """Flight: AA123 / From: City (JFK) / To: City (SFO) / Date / Departure / Arrival / Confirmation number."""
+    flight_number = _reference(_field(text, 'Flight'))
+    origin = re.search(r'\(([A-Z]{3})\)', _field(text, 'From') or '')
+    destination = re.search(r'\(([A-Z]{3})\)', _field(text, 'To') or '')
+    date = _field(text, 'Date')
+    departure = _datetime(date, _field(text, 'Departure'))
+    confirmation = _reference(_field(text, 'Confirmation number', 'Confirmation #', 'Confirmation code'))
+    arrival = _datetime(date, _field(text, 'Arrival'))
+    airline = re.search(r'Flight Confirmation\s*-\s*(.+?)\s*$', text, re.IGNORECASE | re.MULTILINE)
+    airline = airline.group(1) if airline else None
+    confidence = _confidence((flight_number, origin, destination, departure, confirmation), (arrival, airline))
+    if not confidence or departure < datetime.now():
+        return confidence, None
+
+    if arrival is not None and arrival < departure:
+        arrival += timedelta(days=1)  # Overnight flight
+    return confidence, TravelItem(
+        type='flight',
+        description=f"{airline or 'Flight'} {flight_number} from {origin.group(1)} to {destination.group(1)}",
+        start_time=departure.isoformat(),
+        end_time=arrival.isoformat() if arrival else None,
+        details=TravelDetails(
+            confirmation_number=confirmation,
+            price_paid=_price(text),
+            flight_number=flight_number,
+            departure_airport=origin.group(1),
+            arrival_airport=destination.group(1),
+            airline=airline
+        )
+    )
+
+def parse_hotel(text: str) -> Tuple[float, Optional[TravelItem]]:
+    """Hotel / Check-in / Check-out / Room Type / Confirmation #."""
+    hotel_name = _field(text, 'Hotel')
+    check_in = _datetime(_field(text, 'Check-in'))
+    check_out = _datetime(_field(text, 'Check-out'))
+    confirmation = _reference(_field(text, 'Confirmation #', 'Confirmation number', 'Confirmation code'))
+    room_type = _field(text, 'Room Type')
+    confidence = _confidence((hotel_name, check_in, check_out, confirmation), (room_type,))
+    if not confidence or check_out < datetime.now():
+        return confidence, None
+
+    return confidence, TravelItem(
+        type='hotel',
+        description=f"Stay at {hotel_name}",
+        start_time=check_in.isoformat(),
+        end_time=check_out.isoformat(),
+        details=TravelDetails(
+            confirmation_number=confirmation,
+            price_paid=_price(text),
+            hotel_name=hotel_name,
+            room_type=room_type,
+            check_in_time=check_in.strftime('%H:%M'),
+            check_out_time=check_out.strftime('%H:%M')
+        )
+    )
+
+def parse_activity(text: str) -> Tuple[float, Optional[TravelItem]]:
+    """Tour or Activity / Date / optional Time / Location / Booking Reference."""
+    activity_name = _field(text, 'Tour', 'Activity', 'Event')
+    time_value = _field(text, 'Time')
+    start = _datetime(_field(text, 'Date'), time_value)
+    reference = _reference(_field(text, 'Booking Reference', 'Confirmation #', 'Confirmation number'))
+    location = _field(text, 'Location')
+    confidence = _confidence((activity_name, start, reference), (time_value, location))
+    if not confidence or start < datetime.now():
+        return confidence, None
+
+    return confidence, TravelItem(
+        type='activity',
+        description=activity_name,
+        start_time=start.isoformat(),
+        details=TravelDetails(
+            confirmation_number=reference,
+            price_paid=_price(text),
+            activity_name=activity_name,
+            location=location,
+            ticket_type=_field(text, 'Ticket Type')
+        )
+    )
+
+class TemplateRegistry:
+    """Ordered set of templates, with hit counts for each.
+
+    An email is extracted by the one template whose matcher finds its
+    layout, if its parser reaches min_confidence. Parsers read a single
+    booking, so emails with several, such as a round trip or a flight and
+    hotel package, are left to the email parser, as are cancellations,
+    which update existing bookings.
+    """
+
+    def __init__(self, min_confidence: float = 0.5):
+        self.min_confidence = min_confidence
+        self.templates: List[Template] = []
+        self.emails = 0
+        self.hits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, matcher: str, parser: TemplateParser):
+        """Add a template; matcher is a regex searched for in the email."""
+        self.templates.append(Template(name, re.compile(matcher, re.IGNORECASE | re.MULTILINE), parser))
+        self.hits[name] = 0
+
+    def extract(self, email_content: str) -> Optional[TemplateMatch]:
+        """Extract a single-booking email with its template, or None to fall back to the email parser."""
+        with self._lock:
+            self.emails += 1
+        if re.search(r'cancel', email_content, re.IGNORECASE):
+            return None
+        matched = [template for template in self.templates if template.matcher.search(email_content)]
+        # More than one layout, or one layout repeated, means several bookings
+        if len(matched) != 1 or len(matched[0].matcher.findall(email_content)) > 1:
+            return None
+        template = matched[0]
+        confidence, item = template.parser(email_content)
+        if not confidence or confidence < self.min_confidence:
+            return None
+        with self._lock:
+            self.hits[template.name] += 1
+        return TemplateMatch(template.name, confidence, [item] if item is not None else [])
+
+    def stats(self) -> Dict:
+        """Emails seen, and the share of them each template extracted."""
+        hits = sum(self.hits.values())
+        return {
+            "emails": self.emails,
+            "hit_rate": hits / self.emails if self.emails else 0.0,
+            "templates": {
+                name: {"hits": count, "hit_rate": count / self.emails if self.emails else 0.0}
+                for name, count in self.hits.items()
+            }
+        }
+
+def default_registry(min_confidence: float = 0.5) -> TemplateRegistry:
+    """Registry with the built-in flight, hotel and activity templates."""
+    registry = TemplateRegistry(min_confidence)
+    registry.register('flight', r'^[ \t]*Flight:[ \t]*[A-Z0-9]{2}\d{1,4}\b', parse_flight)
+    registry.register('hotel', r'^[ \t]*(?:-[ \t]*)?Check-in:', parse_hotel)
+    registry.register('activity', r'^[ \t]*(?:-[ \t]*)?(?:Tour|Activity|Event):', parse_activity)
+    return registry
@@ -1,4 +1,4 @@
-from travel_assistant import process_travel_email, get_travel_summary
+from travel_assistant import process_travel_emails, format_itinerary
 import asyncio
 
 # Sample travel emails
@@ -81,17 +81,15 @@ async def test_emails():
     
     print("Processing travel emails...\n")
     
-    # Process each email
-    for i, email in enumerate(emails, 1):
-        print(f"\nProcessing Email {i}...")
-        result = await process_travel_email(user_id, email)
-        print(f"Result: {result}\n")
+    # Process all emails concurrently
+    results = await process_travel_emails(user_id, emails, concurrency=4)
+    for i, result in enumerate(results, 1):
+        print(f"\nEmail {i} ({result['seconds']:.1f}s)...")
+        print(f"Result: {result['result'] if result['error'] is None else 'Error: ' + result['error']}\n")
     
     # Get final summary
-    print("\nGetting final travel summary...")
-    summary = await get_travel_summary(user_id)
     print("\nFinal Travel Summary:")
-    print(summary)
+    print(format_itinerary(user_id))
 
 if __name__ == "__main__":
     asyncio.run(test_emails()) 
\ No newline at end of file
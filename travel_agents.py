@@ -0,0 +1,197 @@
+"""Agents and tools of the travel assistant.
+
+Importing this module loads the agents SDK, which is slow, so
+travel_assistant only imports it when a model is first called.
+"""
+from contextvars import ContextVar
+from typing import List, Literal, Optional
+
+from agents import Agent, function_tool
+from pydantic import Field
+
+from app_context import app
+from models import ExtractedItems, TravelDetails, TravelItem
+
+# Items stored by store_travel_item during the current email parser run
+_recorded_items: ContextVar[Optional[List[dict]]] = ContextVar("recorded_items", default=None)
+
+# Define our tools
+@function_tool
+def store_travel_item(
+    user_id: str,
+    item_type: Literal['flight', 'hotel', 'activity'],
+    description: str,
+    start_time: str,
+    end_time: Optional[str] = None,
+    confirmation_number: Optional[str] = None,
+    booking_status: Literal['confirmed', 'cancelled', 'pending'] = 'confirmed',
+    price_paid: Optional[float] = None,
+    # Flight details
+    flight_number: Optional[str] = None,
+    departure_airport: Optional[str] = None,
+    arrival_airport: Optional[str] = None,
+    airline: Optional[str] = None,
+    # Hotel details
+    hotel_name: Optional[str] = None,
+    room_type: Optional[str] = None,
+    check_in_time: Optional[str] = None,
+    check_out_time: Optional[str] = None,
+    # Activity details
+    activity_name: Optional[str] = None,
+    location: Optional[str] = None,
+    ticket_type: Optional[str] = None
+) -> dict:
+    """Store a travel item for a user."""
+    try:
+        details = TravelDetails(
+            confirmation_number=confirmation_number,
+            booking_status=booking_status,
+            price_paid=price_paid,
+            flight_number=flight_number,
+            departure_airport=departure_airport,
+            arrival_airport=arrival_airport,
+            airline=airline,
+            hotel_name=hotel_name,
+            room_type=room_type,
+            check_in_time=check_in_time,
+            check_out_time=check_out_time,
+            activity_name=activity_name,
+            location=location,
+            ticket_type=ticket_type
+        )
+        
+        item = TravelItem(
+            type=item_type,
+            description=description,
+            details=details,
+            start_time=start_time,
+            end_time=end_time
+        )
+        app.store.add_travel_item(user_id, item)
+        recorded = _recorded_items.get()
+        if recorded is not None:
+            recorded.append(item.model_dump())
+        return {"status": "success", "item": item.model_dump()}
+    except Exception as e:
+        return {"status": "error", "reason": str(e)}
+
+@function_tool
+def get_user_itinerary(
+    user_id: str = Field(..., description="ID of the user"),
+    include_past: bool = Field(False, description="Whether to include past items"),
+    include_cancelled: bool = Field(False, description="Whether to include cancelled items")
+) -> List[dict]:
+    """Get travel items for a user with options to include past and cancelled items."""
+    return app.store.get_user_trips(user_id, include_past, include_cancelled)
+
+@function_tool
+def get_itinerary_view(
+    user_id: str = Field(..., description="ID of the user")
+) -> dict:
+    """Get a user's upcoming confirmed items grouped by type, sorted chronologically, with scheduling conflicts."""
+    return app.store.get_itinerary_view(user_id)
+
+# Rules shared by both extraction modes
+EMAIL_PARSER_RULES = """IMPORTANT RULES:
+    1. Only process CONFIRMED bookings with a valid confirmation/ticket number
+    2. Skip any promotional emails or price tracking
+    3. Skip any cancelled bookings
+    4. Only process future travel items
+    5. For activities, only save those with actual tickets/bookings
+    
+    For flights, extract:
+    - Flight number and airline
+    - Departure/arrival airports
+    - Exact times
+    - Confirmation number
+    - Booking status (confirmed/cancelled)
+    - Price paid if available
+    
+    For hotels, extract:
+    - Hotel name
+    - Exact check-in/out dates and times
+    - Confirmation number
+    - Room type
+    - Price paid if available
+    
+    For activities, ONLY extract if there's a confirmed booking:
+    - Activity name
+    - Exact date and time
+    - Location
+    - Ticket/booking reference
+    - Ticket type
+    - Price paid if available
+    
+    DO NOT process:
+    - Price alerts or deals
+    - Wishlists or saved items
+    - Past travel items
+    - Cancelled bookings
+    - Activities without a booking confirmation"""
+
+# Create our specialized agents
+email_parser = Agent(
+    name="Email Parser",
+    instructions="""You are an expert at parsing travel-related emails.
+    Extract key information like flight details, hotel bookings, and activities.
+    When you find travel information, use store_travel_item to save it.
+    
+    """ + EMAIL_PARSER_RULES,
+    tools=[store_travel_item]
+)
+
+# Structured extraction returns all items in one response instead of
+# calling store_travel_item once per item
+email_extractor = Agent(
+    name="Email Extractor",
+    instructions="""You are an expert at parsing travel-related emails.
+    Extract key information like flight details, hotel bookings, and activities.
+    Return every travel item to save in items, or an empty list if there is none.
+    
+    """ + EMAIL_PARSER_RULES,
+    output_type=ExtractedItems
+)
+
+itinerary_manager = Agent(
+    name="Itinerary Manager",
+    instructions="""You help manage and organize travel itineraries.
+    You can retrieve travel information and present it in a clear, organized way.
+    Consider time zones and travel duration when organizing schedules.
+    
+    When presenting information:
+    1. Only show upcoming, confirmed travel items
+    2. Group items by type (flights, hotels, activities)
+    3. Sort chronologically
+    4. Include confirmation numbers and important details
+    5. Skip any cancelled items
+    6. Highlight any scheduling conflicts
+    
+    Format the output in a clear, easy-to-read way with:
+    - Dates and times
+    - Confirmation numbers
+    - Important details like flight numbers or hotel names
+    - Prices when available
+    
+    Use get_itinerary_view for upcoming items, since it is already grouped,
+    sorted and lists the conflicts. Only use get_user_itinerary when past or
+    cancelled items are asked for.""",
+    tools=[get_itinerary_view, get_user_itinerary]
+)
+
+# Main travel assistant that coordinates between agents
+travel_assistant = Agent(
+    name="Travel Assistant",
+    instructions="""You are a helpful travel assistant that:
+    1. Processes travel emails to extract important information
+    2. Only saves confirmed bookings with valid confirmation numbers
+    3. Skips promotional emails and unconfirmed activities
+    4. Manages upcoming travel itineraries
+    5. Provides helpful updates about confirmed travel plans
+    
+    Use the email parser agent for processing emails and the itinerary manager
+    for organizing travel information.
+    
+    Be friendly and helpful in your responses, but be strict about only
+    processing actual confirmed bookings.""",
+    handoffs=[email_parser, itinerary_manager]
+)
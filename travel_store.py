@@ -0,0 +1,922 @@
+import argparse
+import copy
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from typing import List, Optional, Dict, Union
+
+from itinerary import ItineraryView
+from models import TravelItem
+
+
+def synchronized(method):
+    """Run a store method while holding the store's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class StorageBackend:
+    """Interface shared by the travel item storage engines.
+
+    Backends store items as the dicts produced by TravelItem.model_dump()
+    and must dedup bookings the same way _is_same_booking does. They must
+    be safe to call from several threads, since sync agent tools run in
+    worker threads and emails are processed concurrently.
+    """
+
+    def add_travel_item(self, user_id: str, item: TravelItem) -> dict:
+        """Add or update a travel item, handling cancellations and updates."""
+        raise NotImplementedError
+
+    def add_travel_items(self, user_id: str, items: List[Union[TravelItem, dict]]) -> List[dict]:
+        """Add, update or cancel many items as one transaction that is persisted once.
+
+        Items are applied in order, so duplicates within the batch resolve
+        as they would with one add_travel_item call each. If any item fails
+        validation or cannot be applied, none of them are kept.
+        """
+        raise NotImplementedError
+
+    def get_user_trips(self, user_id: str, include_past: bool = False, include_cancelled: bool = False) -> List[dict]:
+        """Get user's trips in chronological order, with options to include past and cancelled items."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release any files or connections held by the backend."""
+
+    def get_itinerary_view(self, user_id: str) -> Dict:
+        """Upcoming confirmed items grouped by type and sorted, with their conflicts.
+
+        Served from a per-user ItineraryView that is built on first use and
+        then kept up to date by every add, update and cancellation.
+        """
+        with self._lock:
+            view = self._views.get(user_id)
+            if view is None:
+                view = ItineraryView(self._start_timestamp)
+                for key, item in self._iter_user_items(user_id):
+                    view.update(key, item)
+                self._views[user_id] = view
+            return view.snapshot()
+
+    def _iter_user_items(self, user_id: str):
+        """Yield (key, item) for every stored item of a user."""
+        raise NotImplementedError
+
+    def _update_view(self, user_id: str, key: int, item: dict):
+        view = self._views.get(user_id)
+        if view is not None:
+            view.update(key, item)
+
+    @contextmanager
+    def deferred_flush(self):
+        """Hold back persistence of all writes made inside the block until it exits.
+
+        For code paths that make many writes, such as a Gmail backfill.
+        Writes still take effect in memory (or the open transaction) right
+        away, and are flushed together when the outermost block exits, even
+        if it exits with an error. Blocks can be nested.
+        """
+        with self._lock:
+            self._defer_depth += 1
+            if self._defer_depth == 1:
+                self._begin_deferred()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._defer_depth -= 1
+                if self._defer_depth == 0:
+                    self._flush()
+
+    def _begin_deferred(self):
+        """Called when the outermost deferred_flush block starts."""
+
+    def _flush(self):
+        """Persist writes held back by deferred_flush."""
+
+    def _validate_items(self, items: List[Union[TravelItem, dict]]) -> List[dict]:
+        # Every item is validated before any is applied
+        return [TravelItem.model_validate(item).model_dump() for item in items]
+
+    def _start_timestamp(self, start_time: str) -> datetime:
+        """Normalize a start time to a naive datetime for ordering and upcoming checks.
+
+        Start times that cannot be parsed sort last, so they always count as
+        upcoming, just as they did when they were compared against a fresh
+        datetime.now() on every read.
+        """
+        try:
+            dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+            return dt.replace(tzinfo=None)  # Make naive
+        except Exception:
+            return datetime.max
+
+    def _is_same_booking(self, item1: dict, item2: dict) -> bool:
+        """Compare two travel items to check if they're the same booking."""
+        details1 = item1.get('details', {})
+        details2 = item2.get('details', {})
+        
+        # If both have confirmation numbers, compare those
+        if details1.get('confirmation_number') and details2.get('confirmation_number'):
+            return details1['confirmation_number'] == details2['confirmation_number']
+        
+        # Otherwise compare key details based on type
+        if item1['type'] != item2['type']:
+            return False
+            
+        if item1['type'] == 'flight':
+            return (
+                details1.get('flight_number') == details2.get('flight_number') and
+                details1.get('departure_airport') == details2.get('departure_airport') and
+                details1.get('arrival_airport') == details2.get('arrival_airport') and
+                item1.get('start_time') == item2.get('start_time')
+            )
+        elif item1['type'] == 'hotel':
+            return (
+                details1.get('hotel_name') == details2.get('hotel_name') and
+                item1.get('start_time') == item2.get('start_time') and
+                item1.get('end_time') == item2.get('end_time')
+            )
+        elif item1['type'] == 'activity':
+            return (
+                details1.get('activity_name') == details2.get('activity_name') and
+                details1.get('location') == details2.get('location') and
+                item1.get('start_time') == item2.get('start_time')
+            )
+        return False
+
+    def _booking_key(self, item: dict) -> Optional[tuple]:
+        """Natural key of a booking, built from the fields _is_same_booking compares."""
+        details = item.get('details', {})
+        if item['type'] == 'flight':
+            return (
+                'flight',
+                details.get('flight_number'),
+                details.get('departure_airport'),
+                details.get('arrival_airport'),
+                item.get('start_time')
+            )
+        elif item['type'] == 'hotel':
+            return ('hotel', details.get('hotel_name'), item.get('start_time'), item.get('end_time'))
+        elif item['type'] == 'activity':
+            return ('activity', details.get('activity_name'), details.get('location'), item.get('start_time'))
+        return None
+
+
+# Simple file-based storage
+class TravelStore(StorageBackend):
+    """JSON file storage for travel items.
+
+    By default every write rewrites the whole file. With journal=True each
+    add, update or cancel is appended to a write-ahead journal next to the
+    snapshot instead, and the journal is compacted into a new snapshot once
+    it grows past journal_max_bytes. Inside deferred_flush, and for each
+    add_travel_items batch, the file is rewritten (or the journal synced)
+    once at the end.
+    """
+
+    def __init__(self, file_path="travel_data.json", journal: bool = False, journal_max_bytes: int = 4 * 1024 * 1024):
+        self.file_path = file_path
+        self.journal = journal
+        self.journal_path = f"{file_path}.journal"
+        self.journal_max_bytes = journal_max_bytes
+        self._journal_file = None
+        # Sequence number of the last journal record reflected in self.data
+        self._journal_seq = 0
+        self._lock = threading.RLock()
+        self._defer_depth = 0
+        self._dirty = False  # Unsaved changes while persistence is deferred
+        self._pending_records: List[dict] = []  # Journal records not yet written
+        self.data = self._load_data()
+        # Per-user dedup indexes and itinerary views, built lazily from self.data
+        self._indexes: Dict[str, dict] = {}
+        self._views: Dict[str, ItineraryView] = {}
+
+    def _load_data(self) -> dict:
+        data = {"trips": {}}
+        if os.path.exists(self.file_path):
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+        self._journal_seq = data.pop("journal_seq", 0)
+        self._replay_journal(data)
+        return data
+
+    def _replay_journal(self, data: dict):
+        """Apply journal records newer than the snapshot to the loaded data."""
+        if not os.path.exists(self.journal_path):
+            return
+        valid_bytes = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                # A torn write from a crash ends the journal; it is truncated below
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                if record["seq"] <= self._journal_seq:
+                    continue  # Already part of the snapshot
+                self._apply_record(data, record)
+                self._journal_seq = record["seq"]
+        if valid_bytes < os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(valid_bytes)
+
+    def _apply_record(self, data: dict, record: dict):
+        trips = data["trips"].setdefault(record["user_id"], [])
+        if record["op"] == "add":
+            trips.append(record["item"])
+        elif record["op"] == "update":
+            trips[record["index"]] = record["item"]
+        elif record["op"] == "cancel":
+            trips[record["index"]]['details']['booking_status'] = 'cancelled'
+
+    def _save_data(self):
+        """Atomically write a full snapshot of self.data."""
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({**self.data, "journal_seq": self._journal_seq}, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+
+    def _persist(self, op: str, user_id: str, index: int, item: Optional[dict] = None):
+        """Persist a single change, either as a journal record or as a full snapshot.
+
+        While persistence is deferred the change is only recorded, and
+        written by _flush.
+        """
+        if not self.journal:
+            if self._defer_depth:
+                self._dirty = True
+            else:
+                self._save_data()
+            return
+        self._journal_seq += 1
+        self._pending_records.append(
+            {"seq": self._journal_seq, "op": op, "user_id": user_id, "index": index, "item": item}
+        )
+        if not self._defer_depth:
+            self._flush()
+
+    def _flush(self):
+        if self._dirty:
+            self._save_data()
+            self._dirty = False
+        if not self._pending_records:
+            return
+        if self._journal_file is None:
+            self._journal_file = open(self.journal_path, 'a')
+        self._journal_file.write(''.join(json.dumps(record, default=str) + "\n" for record in self._pending_records))
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+        self._pending_records = []
+        if self._journal_file.tell() >= self.journal_max_bytes:
+            self.compact()
+
+    @synchronized
+    def compact(self):
+        """Fold the journal into a new snapshot and truncate it."""
+        self._save_data()
+        # Records up to _journal_seq are now in the snapshot, so a crash
+        # before the truncate only leaves records that replay will skip
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'w'):
+                pass
+
+    @synchronized
+    def close(self):
+        """Close the journal file, if one is open."""
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    def _get_user_index(self, user_id: str) -> dict:
+        """Return the user's item index, building it from stored items on first use.
+
+        The index maps confirmation numbers and natural keys to the sorted
+        positions of matching items in the user's trip list, and keeps the
+        items' parsed start times as (timestamp, position) pairs sorted
+        chronologically.
+        """
+        index = self._indexes.get(user_id)
+        if index is None:
+            index = {"confirmation": {}, "key": {}, "start": [], "start_ts": {}}
+            for position, item in enumerate(self.data["trips"].get(user_id, [])):
+                self._index_item(index, position, item)
+            self._indexes[user_id] = index
+        return index
+
+    def _index_item(self, index: dict, position: int, item: dict):
+        confirmation_number = item.get('details', {}).get('confirmation_number')
+        if confirmation_number:
+            insort(index["confirmation"].setdefault(confirmation_number, []), position)
+        key = self._booking_key(item)
+        if key is not None:
+            insort(index["key"].setdefault(key, []), position)
+        start_ts = self._start_timestamp(item['start_time'])
+        index["start_ts"][position] = start_ts
+        insort(index["start"], (start_ts, position))
+
+    def _unindex_item(self, index: dict, position: int, item: dict):
+        confirmation_number = item.get('details', {}).get('confirmation_number')
+        key = self._booking_key(item)
+        for table, value in (("confirmation", confirmation_number), ("key", key)):
+            positions = index[table].get(value)
+            if positions and position in positions:
+                positions.remove(position)
+                if not positions:
+                    del index[table][value]
+        start_ts = index["start_ts"].pop(position)
+        del index["start"][bisect_left(index["start"], (start_ts, position))]
+
+    def _find_booking(self, user_id: str, item_dict: dict) -> Optional[int]:
+        """Find the position of the stored item that a new item should update or cancel.
+
+        Gives the same answer as scanning the trip list with _is_same_booking:
+        a cancellation applies to the first matching item, anything else
+        replaces the first matching item that is not cancelled.
+        """
+        existing_trips = self.data["trips"].get(user_id, [])
+        index = self._get_user_index(user_id)
+        confirmation_number = item_dict.get('details', {}).get('confirmation_number')
+        key_matches = index["key"].get(self._booking_key(item_dict), [])
+
+        if confirmation_number:
+            # Items with a confirmation number only match on that number,
+            # items without one still match on their natural key
+            candidates = index["confirmation"].get(confirmation_number, []) + [
+                i for i in key_matches
+                if not existing_trips[i].get('details', {}).get('confirmation_number')
+            ]
+            candidates.sort()
+        else:
+            candidates = key_matches
+
+        is_cancellation = item_dict.get('details', {}).get('booking_status') == 'cancelled'
+        for i in candidates:
+            if is_cancellation or existing_trips[i].get('details', {}).get('booking_status') != 'cancelled':
+                return i
+        return None
+
+    @synchronized
+    def add_travel_item(self, user_id: str, item: TravelItem) -> dict:
+        """Add or update a travel item, handling cancellations and updates."""
+        return self._add_item(user_id, item.model_dump())
+
+    @synchronized
+    def add_travel_items(self, user_id: str, items: List[Union[TravelItem, dict]]) -> List[dict]:
+        """Add, update or cancel many items as one transaction that is persisted once."""
+        item_dicts = self._validate_items(items)
+        trips = self.data["trips"].get(user_id)
+        saved_trips = copy.deepcopy(trips)
+        saved_seq = self._journal_seq
+        saved_pending = len(self._pending_records)
+
+        self._defer_depth += 1
+        try:
+            results = [self._add_item(user_id, item_dict) for item_dict in item_dicts]
+        except Exception:
+            # Roll back to the state before the batch
+            if saved_trips is None:
+                self.data["trips"].pop(user_id, None)
+            else:
+                self.data["trips"][user_id] = saved_trips
+            self._indexes.pop(user_id, None)
+            self._views.pop(user_id, None)
+            del self._pending_records[saved_pending:]
+            self._journal_seq = saved_seq
+            raise
+        finally:
+            self._defer_depth -= 1
+        if not self._defer_depth:
+            self._flush()
+        return results
+
+    def _add_item(self, user_id: str, item_dict: dict) -> dict:
+        if user_id not in self.data["trips"]:
+            self.data["trips"][user_id] = []
+        
+        existing_trips = self.data["trips"][user_id]
+        index = self._get_user_index(user_id)
+        
+        # Check for existing booking
+        i = self._find_booking(user_id, item_dict)
+        if i is not None:
+            existing_item = existing_trips[i]
+            # If new item is cancelled, update status of existing item
+            if item_dict.get('details', {}).get('booking_status') == 'cancelled':
+                existing_item['details']['booking_status'] = 'cancelled'
+                self._update_view(user_id, i, existing_item)
+                self._persist("cancel", user_id, i)
+                return {"status": "cancelled", "item": existing_item}
+            
+            # Otherwise the existing item is still active, so update it
+            self._unindex_item(index, i, existing_item)
+            existing_trips[i] = item_dict
+            self._index_item(index, i, item_dict)
+            self._update_view(user_id, i, item_dict)
+            self._persist("update", user_id, i, item_dict)
+            return {"status": "updated", "item": item_dict}
+        
+        # Add as new item (cancelled matches are treated as a new booking)
+        existing_trips.append(item_dict)
+        self._index_item(index, len(existing_trips) - 1, item_dict)
+        self._update_view(user_id, len(existing_trips) - 1, item_dict)
+        self._persist("add", user_id, len(existing_trips) - 1, item_dict)
+        return {"status": "added", "item": item_dict}
+
+    def _iter_user_items(self, user_id: str):
+        return enumerate(self.data["trips"].get(user_id, []))
+
+    @synchronized
+    def get_user_trips(self, user_id: str, include_past: bool = False, include_cancelled: bool = False) -> List[dict]:
+        """Get user's trips, with options to include past and cancelled items."""
+        try:
+            all_trips = self.data["trips"].get(user_id, [])
+            start_index = self._get_user_index(user_id)["start"]
+            filtered_trips = []
+
+            # Items are kept sorted by start time, so upcoming items are the
+            # tail after the first one starting later than now
+            first = 0
+            if not include_past:
+                now = datetime.now().replace(tzinfo=None)  # Make naive
+                first = bisect_right(start_index, (now, len(all_trips)))
+
+            for _, position in start_index[first:]:
+                trip = all_trips[position]
+                # Skip cancelled items unless specifically requested
+                if not include_cancelled and trip.get('details', {}).get('booking_status') == 'cancelled':
+                    continue
+                filtered_trips.append(trip)
+            
+            return filtered_trips
+            
+        except Exception as e:
+            print(f"Error retrieving trips: {str(e)}")
+            return []
+
+
+class SQLiteTravelStore(StorageBackend):
+    """SQLite storage for travel items.
+
+    Items live in an `items` table with their details in `details`. Dedup
+    and itinerary reads are indexed queries, so nothing is loaded into
+    memory up front and cost does not grow with other users' history.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            description TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT,
+            -- start_time normalized to a sortable naive ISO timestamp
+            start_ts TEXT NOT NULL,
+            confirmation_number TEXT,
+            booking_status TEXT NOT NULL,
+            -- JSON encoded _booking_key, used to dedup items without a confirmation number
+            natural_key TEXT
+        );
+        CREATE TABLE IF NOT EXISTS details (
+            item_id INTEGER PRIMARY KEY REFERENCES items(id),
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_items_user_start ON items(user_id, start_ts);
+        CREATE INDEX IF NOT EXISTS idx_items_confirmation ON items(user_id, confirmation_number);
+        CREATE INDEX IF NOT EXISTS idx_items_natural_key ON items(user_id, natural_key);
+        CREATE INDEX IF NOT EXISTS idx_items_status ON items(booking_status);
+    """
+
+    def __init__(self, file_path="travel_data.db"):
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._defer_depth = 0
+        self._views: Dict[str, ItineraryView] = {}
+        self.conn = sqlite3.connect(file_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def _start_ts(self, start_time: str) -> str:
+        return self._start_timestamp(start_time).isoformat(timespec='microseconds')
+
+    def _row_values(self, user_id: str, item_dict: dict) -> tuple:
+        details = item_dict.get('details', {})
+        key = self._booking_key(item_dict)
+        return (
+            user_id,
+            item_dict['type'],
+            item_dict['description'],
+            item_dict['start_time'],
+            item_dict.get('end_time'),
+            self._start_ts(item_dict['start_time']),
+            details.get('confirmation_number') or None,
+            details.get('booking_status', 'confirmed'),
+            json.dumps(key) if key is not None else None
+        )
+
+    def _insert_item(self, user_id: str, item_dict: dict) -> int:
+        cursor = self.conn.execute(
+            """INSERT INTO items (user_id, type, description, start_time, end_time, start_ts,
+                                  confirmation_number, booking_status, natural_key)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            self._row_values(user_id, item_dict)
+        )
+        self.conn.execute(
+            "INSERT INTO details (item_id, data) VALUES (?, ?)",
+            (cursor.lastrowid, json.dumps(item_dict.get('details', {}), default=str))
+        )
+        return cursor.lastrowid
+
+    def _row_to_item(self, row: tuple) -> dict:
+        item_type, description, start_time, end_time, details = row
+        return {
+            "type": item_type,
+            "description": description,
+            "start_time": start_time,
+            "end_time": end_time,
+            "details": json.loads(details)
+        }
+
+    def _find_booking(self, user_id: str, item_dict: dict) -> Optional[int]:
+        """Find the id of the stored item that a new item should update or cancel.
+
+        Mirrors TravelStore._find_booking, with item ids standing in for list
+        positions.
+        """
+        details = item_dict.get('details', {})
+        confirmation_number = details.get('confirmation_number')
+        key = self._booking_key(item_dict)
+        natural_key = json.dumps(key) if key is not None else None
+
+        if confirmation_number:
+            where = "(confirmation_number = ? OR (natural_key = ? AND confirmation_number IS NULL))"
+            params = [user_id, confirmation_number, natural_key]
+        else:
+            where = "natural_key = ?"
+            params = [user_id, natural_key]
+        if details.get('booking_status') != 'cancelled':
+            where += " AND booking_status != 'cancelled'"
+
+        row = self.conn.execute(
+            f"SELECT id FROM items WHERE user_id = ? AND {where} ORDER BY id LIMIT 1",
+            params
+        ).fetchone()
+        return row[0] if row else None
+
+    @contextmanager
+    def _transaction(self):
+        """Apply a group of statements atomically.
+
+        Normally this commits at the end. While persistence is deferred the
+        group runs in a savepoint inside the open transaction instead, so a
+        failure only rolls back its own statements.
+        """
+        try:
+            if not self._defer_depth:
+                with self.conn:
+                    yield
+                return
+            self.conn.execute("SAVEPOINT store_write")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK TO store_write")
+                raise
+            finally:
+                self.conn.execute("RELEASE store_write")
+        except BaseException:
+            # Views may reflect rolled back writes, so rebuild them on next use
+            self._views.clear()
+            raise
+
+    def _begin_deferred(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+
+    def _flush(self):
+        self.conn.commit()
+
+    def _add_item(self, user_id: str, item_dict: dict) -> dict:
+        item_id = self._find_booking(user_id, item_dict)
+        if item_id is not None:
+            # If new item is cancelled, update status of existing item
+            if item_dict.get('details', {}).get('booking_status') == 'cancelled':
+                row = self.conn.execute(
+                    "SELECT type, description, start_time, end_time, data FROM items"
+                    " JOIN details ON details.item_id = items.id WHERE id = ?",
+                    (item_id,)
+                ).fetchone()
+                existing_item = self._row_to_item(row)
+                existing_item['details']['booking_status'] = 'cancelled'
+                self.conn.execute("UPDATE items SET booking_status = 'cancelled' WHERE id = ?", (item_id,))
+                self.conn.execute(
+                    "UPDATE details SET data = ? WHERE item_id = ?",
+                    (json.dumps(existing_item['details'], default=str), item_id)
+                )
+                self._update_view(user_id, item_id, existing_item)
+                return {"status": "cancelled", "item": existing_item}
+
+            # Otherwise the existing item is still active, so update it
+            self.conn.execute(
+                """UPDATE items SET user_id = ?, type = ?, description = ?, start_time = ?, end_time = ?,
+                                    start_ts = ?, confirmation_number = ?, booking_status = ?, natural_key = ?
+                   WHERE id = ?""",
+                self._row_values(user_id, item_dict) + (item_id,)
+            )
+            self.conn.execute(
+                "UPDATE details SET data = ? WHERE item_id = ?",
+                (json.dumps(item_dict.get('details', {}), default=str), item_id)
+            )
+            self._update_view(user_id, item_id, item_dict)
+            return {"status": "updated", "item": item_dict}
+
+        # Add as new item (cancelled matches are treated as a new booking)
+        item_id = self._insert_item(user_id, item_dict)
+        self._update_view(user_id, item_id, item_dict)
+        return {"status": "added", "item": item_dict}
+
+    @synchronized
+    def add_travel_item(self, user_id: str, item: TravelItem) -> dict:
+        """Add or update a travel item, handling cancellations and updates."""
+        item_dict = item.model_dump()
+        with self._transaction():
+            return self._add_item(user_id, item_dict)
+
+    @synchronized
+    def add_travel_items(self, user_id: str, items: List[Union[TravelItem, dict]]) -> List[dict]:
+        """Add, update or cancel many items as one transaction that is committed once."""
+        item_dicts = self._validate_items(items)
+        with self._transaction():
+            return [self._add_item(user_id, item_dict) for item_dict in item_dicts]
+
+    def _iter_user_items(self, user_id: str):
+        rows = self.conn.execute(
+            "SELECT id, type, description, start_time, end_time, data FROM items"
+            " JOIN details ON details.item_id = items.id WHERE user_id = ? ORDER BY id",
+            (user_id,)
+        ).fetchall()
+        return ((row[0], self._row_to_item(row[1:])) for row in rows)
+
+    @synchronized
+    def get_user_trips(self, user_id: str, include_past: bool = False, include_cancelled: bool = False) -> List[dict]:
+        """Get user's trips, with options to include past and cancelled items."""
+        try:
+            where = "user_id = ?"
+            params = [user_id]
+            if not include_cancelled:
+                where += " AND booking_status != 'cancelled'"
+            if not include_past:
+                where += " AND start_ts > ?"
+                params.append(datetime.now().isoformat(timespec='microseconds'))
+            rows = self.conn.execute(
+                "SELECT type, description, start_time, end_time, data FROM items"
+                f" JOIN details ON details.item_id = items.id WHERE {where} ORDER BY start_ts, id",
+                params
+            ).fetchall()
+            return [self._row_to_item(row) for row in rows]
+
+        except Exception as e:
+            print(f"Error retrieving trips: {str(e)}")
+            return []
+
+    @synchronized
+    def import_json(self, json_path: str) -> int:
+        """Copy every item from a JSON TravelStore file, keeping their order.
+
+        Items are copied as stored, without dedup, so the result matches what
+        the JSON store holds. Returns the number of items imported.
+        """
+        source = TravelStore(json_path)
+        count = 0
+        with self._transaction():
+            for user_id, items in source.data["trips"].items():
+                for item_dict in items:
+                    self._insert_item(user_id, item_dict)
+                    count += 1
+        source.close()
+        self._views.clear()
+        return count
+
+    @synchronized
+    def close(self):
+        self.conn.close()
+
+
+class ShardedTravelStore(StorageBackend):
+    """JSON storage split into shards, each one a TravelStore of its own.
+
+    By default every user gets their own file, named by a hash of the user
+    id, so a write only rewrites (or journals to) that user's file. With
+    shards=N users are hashed into N files instead. Shards are loaded on
+    first access and closed again once idle for idle_seconds, so memory
+    and write cost follow the active users rather than all of them. Each
+    shard has its own lock, so writes for different shards do not wait on
+    each other.
+    """
+
+    def __init__(self, directory="travel_data", shards: int = 0, journal: bool = False,
+                 journal_max_bytes: int = 1024 * 1024, idle_seconds: float = 600):
+        self.directory = directory
+        self.shards = shards
+        self.journal = journal
+        self.journal_max_bytes = journal_max_bytes
+        self.idle_seconds = idle_seconds
+        # Guards the shard registry; item operations only hold the shard's lock
+        self._lock = threading.RLock()
+        self._defer_depth = 0
+        self._deferred: Optional[ExitStack] = None
+        self._loaded: Dict[str, TravelStore] = {}
+        self._in_use: Dict[str, int] = {}
+        self._last_used: Dict[str, float] = {}
+        self._last_sweep = time.monotonic()
+        self.loads = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _shard_path(self, user_id: str) -> str:
+        digest = hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+        if self.shards:
+            return os.path.join(self.directory, f"shard-{int(digest, 16) % self.shards:04d}.json")
+        # Spread per-user files over subdirectories to keep directories small
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    @contextmanager
+    def _use(self, user_id: str):
+        """Yield the user's shard, loading it if needed and keeping it loaded while in use."""
+        path = self._shard_path(user_id)
+        with self._lock:
+            shard = self._loaded.get(path)
+            if shard is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                shard = TravelStore(path, journal=self.journal, journal_max_bytes=self.journal_max_bytes)
+                self._loaded[path] = shard
+                self.loads += 1
+                if self._deferred is not None:
+                    self._deferred.enter_context(shard.deferred_flush())
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+        try:
+            yield shard
+        finally:
+            with self._lock:
+                self._in_use[path] -= 1
+                self._last_used[path] = time.monotonic()
+                self._evict_idle()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        if now - self._last_sweep < min(self.idle_seconds, 60):
+            return
+        self._last_sweep = now
+        # Shards held open by deferred_flush are flushed and evicted later
+        if self._deferred is not None:
+            return
+        for path, shard in list(self._loaded.items()):
+            if not self._in_use[path] and now - self._last_used[path] >= self.idle_seconds:
+                shard.close()
+                del self._loaded[path]
+                del self._in_use[path]
+                del self._last_used[path]
+                self.evictions += 1
+
+    def add_travel_item(self, user_id: str, item: TravelItem) -> dict:
+        """Add or update a travel item, handling cancellations and updates."""
+        with self._use(user_id) as shard:
+            return shard.add_travel_item(user_id, item)
+
+    def add_travel_items(self, user_id: str, items: List[Union[TravelItem, dict]]) -> List[dict]:
+        """Add, update or cancel many items as one transaction that is persisted once."""
+        with self._use(user_id) as shard:
+            return shard.add_travel_items(user_id, items)
+
+    def get_user_trips(self, user_id: str, include_past: bool = False, include_cancelled: bool = False) -> List[dict]:
+        """Get user's trips, with options to include past and cancelled items."""
+        with self._use(user_id) as shard:
+            return shard.get_user_trips(user_id, include_past, include_cancelled)
+
+    def get_itinerary_view(self, user_id: str) -> Dict:
+        """Upcoming confirmed items grouped by type and sorted, with their conflicts."""
+        with self._use(user_id) as shard:
+            return shard.get_itinerary_view(user_id)
+
+    def _begin_deferred(self):
+        self._deferred = ExitStack()
+        for shard in self._loaded.values():
+            self._deferred.enter_context(shard.deferred_flush())
+
+    def _flush(self):
+        deferred, self._deferred = self._deferred, None
+        deferred.close()
+
+    def stats(self) -> Dict:
+        """Shards currently loaded, and shard loads and evictions so far."""
+        with self._lock:
+            return {"loaded": len(self._loaded), "loads": self.loads, "evictions": self.evictions}
+
+    def import_json(self, json_path: str) -> int:
+        """Copy every item from a JSON TravelStore file into the shards, keeping their order.
+
+        Like SQLiteTravelStore.import_json, items are copied without dedup.
+        Returns the number of items imported.
+        """
+        source = TravelStore(json_path)
+        count = 0
+        for user_id, items in source.data["trips"].items():
+            with self._use(user_id) as shard, shard._lock:
+                shard.data["trips"].setdefault(user_id, []).extend(items)
+                shard._indexes.pop(user_id, None)
+                shard._views.pop(user_id, None)
+                shard.compact()
+            count += len(items)
+        source.close()
+        return count
+
+    def close(self):
+        """Close every loaded shard."""
+        with self._lock:
+            for shard in self._loaded.values():
+                shard.close()
+            self._loaded.clear()
+            self._in_use.clear()
+            self._last_used.clear()
+
+
+def _store_path(default: str, json_path: str) -> str:
+    # An empty setting means the default too; sqlite3 would open a temporary database for ''
+    path = os.getenv("IRIS_STORE_PATH") or default
+    if os.path.abspath(path) == os.path.abspath(json_path):
+        raise ValueError(f"IRIS_STORE_PATH points at the JSON store {json_path}; "
+                         f"unset it to use {default}, or set IRIS_STORE_MIGRATE_FROM to migrate from another file")
+    return path
+
+
+def create_store() -> StorageBackend:
+    """Build the storage backend selected by IRIS_STORE_BACKEND ('json', 'sqlite' or 'sharded').
+
+    The sqlite and sharded backends are created from the JSON store at
+    IRIS_STORE_MIGRATE_FROM (travel_data.json by default) the first time
+    they start.
+    """
+    backend = os.getenv("IRIS_STORE_BACKEND", "json").lower()
+    journal = os.getenv("IRIS_STORE_JOURNAL", "false").lower() in ("1", "true", "yes")
+    json_path = os.getenv("IRIS_STORE_MIGRATE_FROM") or "travel_data.json"
+    if backend == "sqlite":
+        db_path = _store_path("travel_data.db", json_path)
+        migrate = not os.path.exists(db_path) and os.path.exists(json_path)
+        sqlite_store = SQLiteTravelStore(db_path)
+        if migrate:
+            count = sqlite_store.import_json(json_path)
+            print(f"Migrated {count} travel items from {json_path} to {db_path}")
+        return sqlite_store
+    if backend == "sharded":
+        directory = _store_path("travel_data", json_path)
+        migrate = not os.path.exists(directory) and os.path.exists(json_path)
+        sharded_store = ShardedTravelStore(
+            directory,
+            shards=int(os.getenv("IRIS_STORE_SHARDS", "0")),
+            journal=journal,
+            idle_seconds=float(os.getenv("IRIS_STORE_IDLE_SECONDS", "600"))
+        )
+        if migrate:
+            count = sharded_store.import_json(json_path)
+            print(f"Migrated {count} travel items from {json_path} to {directory}")
+        return sharded_store
+    if backend != "json":
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return TravelStore(os.getenv("IRIS_STORE_PATH") or json_path, journal=journal)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate travel data from the JSON store to SQLite.")
+    parser.add_argument("json_path", nargs="?", default="travel_data.json")
+    parser.add_argument("db_path", nargs="?", default="travel_data.db")
+    args = parser.parse_args()
+
+    sqlite_store = SQLiteTravelStore(args.db_path)
+    count = sqlite_store.import_json(args.json_path)
+    sqlite_store.close()
+    print(f"Migrated {count} travel items from {args.json_path} to {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()